@@ -0,0 +1,110 @@
+import re
+from itertools import combinations
+
+from results_store import parse_output
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def _words(task: str) -> frozenset:
+    return frozenset(WORD_RE.findall(task.lower()))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+# Similarita' tra due liste di task: per ogni task il miglior Jaccard (sulle parole)
+# con un task dell'altra lista, mediato in entrambe le direzioni.
+def task_list_similarity(tasks_a: list[str], tasks_b: list[str]) -> float:
+    if not tasks_a and not tasks_b:
+        return 1.0
+    if not tasks_a or not tasks_b:
+        return 0.0
+    words_a = [_words(t) for t in tasks_a]
+    words_b = [_words(t) for t in tasks_b]
+    best_a = [max(_jaccard(a, b) for b in words_b) for a in words_a]
+    best_b = [max(_jaccard(b, a) for a in words_a) for b in words_b]
+    return (sum(best_a) / len(best_a) + sum(best_b) / len(best_b)) / 2
+
+
+# Variazione tra generazioni: 1 - similarita' media tra tutte le coppie di output
+def task_variation(outputs: list[str]) -> float:
+    task_lists = [parse_output(text)[1] for text in outputs]
+    pairs = list(combinations(task_lists, 2))
+    if not pairs:
+        return 1.0
+    return 1 - sum(task_list_similarity(a, b) for a, b in pairs) / len(pairs)
+
+
+# Campionamento adattivo delle temperature per una variante di prompt.
+# Si parte da una griglia grossolana con `min_generations` generazioni per temperatura;
+# dopo ogni round:
+#   - una temperatura si ferma se la variazione tra le generazioni e' <= stable_threshold
+#     (output convergenti) o se ha raggiunto max_generations, altrimenti riceve un'altra generazione;
+#   - tra due temperature adiacenti la cui variazione differisce di piu' di refine_delta
+#     si aggiunge il punto intermedio (fino a un passo minimo di min_step).
+class AdaptiveSampler:
+    def __init__(self, coarse: list[float], min_generations: int = 2, max_generations: int = 5,
+                 stable_threshold: float = 0.15, refine_delta: float = 0.2, min_step: float = 0.1):
+        self.min_generations = min_generations
+        self.max_generations = max(max_generations, min_generations)
+        self.stable_threshold = stable_threshold
+        self.refine_delta = refine_delta
+        self.min_step = min_step
+        self.outputs = {round(t, 2): {} for t in coarse}
+        self.stopped = {}      # temperatura -> motivo
+        self.variation = {}    # temperatura -> ultima variazione misurata
+        self.target = {t: min_generations for t in self.outputs}
+
+    @property
+    def temperatures(self) -> list[float]:
+        return sorted(self.outputs)
+
+    @property
+    def calls(self) -> int:
+        return sum(len(o) for o in self.outputs.values())
+
+    # Celle (temperatura, generazione) da eseguire nel prossimo round
+    def next_round(self) -> list[tuple[float, int]]:
+        return [
+            (t, gen)
+            for t in self.temperatures if t not in self.stopped
+            for gen in range(1, self.target[t] + 1) if gen not in self.outputs[t]
+        ]
+
+    def record(self, temperature: float, gen: int, text: str):
+        self.outputs[round(temperature, 2)][gen] = text
+
+    # Aggiorna lo stato dopo un round e restituisce le decisioni prese
+    def decide(self) -> list[dict]:
+        decisions = []
+        for t in self.temperatures:
+            if t in self.stopped or len(self.outputs[t]) < self.target[t]:
+                continue
+            texts = [self.outputs[t][g] for g in sorted(self.outputs[t])]
+            v = task_variation(texts)
+            self.variation[t] = v
+            if v <= self.stable_threshold:
+                self.stopped[t] = "converged"
+            elif len(texts) >= self.max_generations:
+                self.stopped[t] = "budget"
+            else:
+                self.target[t] = len(texts) + 1
+            decisions.append({"temperature": t, "generations": len(texts), "variation": v,
+                              "action": self.stopped.get(t, "sample_more")})
+
+        measured = [t for t in self.temperatures if t in self.variation]
+        for lo, hi in zip(measured, measured[1:]):
+            mid = round(round((lo + hi) / 2 / self.min_step) * self.min_step, 2)
+            if (abs(self.variation[hi] - self.variation[lo]) > self.refine_delta
+                    and hi - lo > self.min_step * 1.5 and mid not in self.outputs):
+                self.outputs[mid] = {}
+                self.target[mid] = self.min_generations
+                decisions.append({"temperature": mid, "generations": 0, "variation": None,
+                                  "action": f"refine_between_{lo:.1f}_{hi:.1f}"})
+        return decisions
+
+    @property
+    def done(self) -> bool:
+        return not self.next_round()
@@ -0,0 +1,172 @@
+import argparse
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+from mock_ollama import MockOllama
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SYSTEMS = ["BrainMed", "Anonymous"]
+SUMMARY_RE = re.compile(r"Sweep completed: (\d+) generations, (\d+) failed, wall=([\d.]+)s")
+FAILOVER_RE = re.compile(r"Endpoint pool: \d+ endpoints, (\d+) failovers")
+
+
+def _post(url: str):
+    urllib.request.urlopen(urllib.request.Request(url, data=b"{}", method="POST")).read()
+
+
+def _get_json(url: str) -> dict:
+    return json.loads(urllib.request.urlopen(url).read())
+
+
+# Esegue il loop_temp_prompt.py del sistema come sottoprocesso contro i mock (uno per endpoint del pool),
+# con tracking MLflow su file (nessun server), cache e ripresa disattivate. Con fail_after
+# l'ultimo mock viene fermato dopo quei secondi per verificare il failover.
+# Restituisce tempi e memoria del processo e le chiamate servite da ogni endpoint.
+def run_sweep(mocks: list[MockOllama], workdir: str, concurrency: int, num_generations: int,
+              temperatures: list[float], streaming: bool, model: str,
+              fail_after: float | None = None, system: str = "BrainMed") -> dict:
+    mock = mocks[0]
+    overrides = {
+        "ollama_url": mock.url,
+        "ollama_endpoints": [m.url for m in mocks],
+        "tracking_uri": Path(workdir, "mlruns").as_uri(),
+        "experiment_name": f"benchmark_c{concurrency}_{int(time.time())}",
+        "models": [model],
+        "model_choice": 0,
+        "run_all_models": False,
+        "num_generations": num_generations,
+        "temperatures": temperatures,
+        "max_concurrency": concurrency,
+        "use_cache": False,
+        "resume": False,
+        "store_results": False,
+        "streaming": streaming,
+        "stream_dir": os.path.join(workdir, "outputs"),
+    }
+    env = {**os.environ, "SWEEP_OVERRIDES": json.dumps(overrides)}
+    for m in mocks:
+        _post(f"{m.url}/stats/reset")
+    killer = threading.Timer(fail_after, mocks[-1].stop) if fail_after is not None else None
+    if killer is not None:
+        killer.start()
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "loop_temp_prompt.py"], cwd=os.path.join(HERE, "..", f"Source_code_{system}"), env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    with proc.stdout:
+        stdout = proc.stdout.read()
+    # wait4 restituisce le risorse di questo solo processo: RUSAGE_CHILDREN riporterebbe il
+    # picco del figlio piu' grande tra tutti quelli terminati finora
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if killer is not None:
+        killer.cancel()
+    process_wall = time.perf_counter() - start
+    # ru_maxrss in KB su Linux
+    peak_rss_mb = usage.ru_maxrss / 1024
+
+    match = SUMMARY_RE.search(stdout)
+    if proc.returncode != 0 or match is None:
+        raise RuntimeError(f"Sweep failed (exit {proc.returncode}):\n{stdout[-3000:]}")
+    calls, failed, grid_wall = int(match.group(1)), int(match.group(2)), float(match.group(3))
+    stats = _get_json(f"{mock.url}/stats")
+    endpoint_calls = []
+    for m in mocks:
+        try:
+            endpoint_calls.append(_get_json(f"{m.url}/stats")["chat"])
+        except OSError:
+            endpoint_calls.append(None)   # mock fermato durante la sweep
+
+    ideal_wall = math.ceil(calls / concurrency) * mock.scripted_latency
+    return {
+        "concurrency": concurrency,
+        "calls": calls,
+        "failed": failed,
+        "grid_wall_s": grid_wall,
+        "setup_s": process_wall - grid_wall,
+        "throughput_calls_s": calls / grid_wall if grid_wall else 0.0,
+        "ideal_wall_s": ideal_wall,
+        # Tempo medio di occupazione di uno slot oltre la latenza scriptata del modello
+        "overhead_per_call_ms": (grid_wall * concurrency / calls - mock.scripted_latency) * 1000 if calls else 0.0,
+        "peak_rss_mb": peak_rss_mb,
+        "server_max_in_flight": stats["max_in_flight"],
+        "endpoint_calls": endpoint_calls,
+        "failovers": sum(int(n) for n in FAILOVER_RE.findall(stdout)),
+    }
+
+
+def print_table(results: list[dict]):
+    header = (f"{'conc':>4} {'calls':>5} {'wall s':>8} {'ideal s':>8} {'calls/s':>8} {'ovh ms':>8} "
+              f"{'setup s':>8} {'rss MB':>8} {'inflight':>8} {'failover':>8}  per endpoint")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['concurrency']:>4} {r['calls']:>5} {r['grid_wall_s']:>8.2f} {r['ideal_wall_s']:>8.2f} "
+            f"{r['throughput_calls_s']:>8.2f} {r['overhead_per_call_ms']:>8.1f} {r['setup_s']:>8.2f} "
+            f"{r['peak_rss_mb']:>8.0f} {r['server_max_in_flight']:>8} {r['failovers']:>8}  "
+            + "/".join("-" if n is None else str(n) for n in r["endpoint_calls"])
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the sweep runner against a scripted mock Ollama server")
+    parser.add_argument("--system", choices=SYSTEMS, default="BrainMed", help="which Source_code_* loop to run")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--endpoints", type=int, default=1, help="mock servers in the pool, on consecutive ports")
+    parser.add_argument("--fail-after", type=float, default=None,
+                        help="stop the last mock after this many seconds to exercise failover")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--generations", type=int, default=1)
+    parser.add_argument("--temperatures", type=float, nargs="+", default=[0.0, 0.5, 1.0])
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tps", type=float, default=200.0)
+    parser.add_argument("--no-streaming", action="store_true")
+    parser.add_argument("--model", default="mock-vision:latest")
+    parser.add_argument("--out", default=None, help="write the results as JSON")
+    parser.add_argument("--max-overhead-ms", type=float, default=None,
+                        help="exit with status 1 if the per-call overhead exceeds this value")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for concurrency in args.concurrency:
+            # Mock nuovi per ogni livello: con --fail-after l'ultimo viene fermato
+            mocks = [
+                MockOllama(port=args.port + i, ttft=args.ttft, tokens_per_second=args.tps, load_time=0.0).start()
+                for i in range(args.endpoints)
+            ]
+            print(f"Mock Ollama on {', '.join(m.url for m in mocks)}, "
+                  f"scripted latency {mocks[0].scripted_latency:.2f}s per call")
+            try:
+                results.append(run_sweep(
+                    mocks, workdir, concurrency, args.generations, args.temperatures,
+                    not args.no_streaming, args.model, args.fail_after, args.system,
+                ))
+            finally:
+                for m in mocks:
+                    try:
+                        m.stop()
+                    except OSError:
+                        pass
+
+    print_table(results)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.max_overhead_ms is not None:
+        worst = max(r["overhead_per_call_ms"] for r in results)
+        if worst > args.max_overhead_ms:
+            print(f"Per-call overhead {worst:.1f} ms exceeds {args.max_overhead_ms:.1f} ms")
+            sys.exit(1)
@@ -0,0 +1,114 @@
+import json
+import os
+import re
+import threading
+from typing import Callable
+
+from mlflow.tracking import MlflowClient
+
+
+# Chiave deterministica di una cella della griglia
+def run_key(run_name: str, gen: int) -> str:
+    return f"{run_name}#gen{gen}"
+
+
+# Indice locale append-only delle generazioni completate, una riga JSON per evento.
+# Ogni riga viene scritta con fsync, quindi dopo un crash l'indice contiene
+# esattamente le generazioni il cui output e' gia' stato salvato su MLflow.
+# Ogni generazione registra anche la sua impronta (la chiave di cache: prompt renderizzato,
+# seed, immagini, parametri): una generazione con un'impronta diversa da quella attuale
+# conta come mancante, quindi modificare un prompt o le immagini la fa rigenerare.
+class CompletionIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self.run_ids = {}        # run_name -> run_id
+        self.done = {}           # run_key(run_name, gen) -> impronta (None = sconosciuta)
+        self.closed = {}         # run_id -> status
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        # Ultima riga troncata da un crash durante la scrittura
+                        continue
+
+    def _apply(self, event: dict):
+        if event["event"] == "generation":
+            self.run_ids[event["run_name"]] = event["run_id"]
+            self.done[run_key(event["run_name"], event["gen"])] = event.get("fingerprint")
+        elif event["event"] == "run_started":
+            # Nuova run con lo stesso nome (impronte cambiate): le generazioni della run
+            # precedente non contano piu' come salvate
+            if self.run_ids.get(event["run_name"], event["run_id"]) != event["run_id"]:
+                prefix = run_key(event["run_name"], 0)[:-1]
+                self.done = {k: v for k, v in self.done.items() if not k.startswith(prefix)}
+            self.run_ids[event["run_name"]] = event["run_id"]
+        elif event["event"] == "run_closed":
+            self.closed[event["run_id"]] = event["status"]
+
+    def _append(self, event: dict):
+        with self._lock:
+            self._apply(event)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    # Senza fingerprint basta che la generazione sia stata salvata; con fingerprint deve
+    # essere stata salvata con la stessa impronta
+    def is_done(self, run_name: str, gen: int, fingerprint: str | None = None) -> bool:
+        key = run_key(run_name, gen)
+        return key in self.done and (fingerprint is None or self.done[key] == fingerprint)
+
+    # `fingerprint(gen)` restituisce l'impronta attuale della generazione gen
+    def missing(self, run_name: str, num_generations: int,
+                fingerprint: Callable[[int], str] | None = None) -> list[int]:
+        return [
+            g for g in range(1, num_generations + 1)
+            if not self.is_done(run_name, g, fingerprint(g) if fingerprint else None)
+        ]
+
+    # True se la run ha generazioni salvate con un'impronta diversa da quella attuale: i suoi
+    # parametri descrivono un'altra configurazione e non va riaperta
+    def changed(self, run_name: str, num_generations: int, fingerprint: Callable[[int], str]) -> bool:
+        return any(
+            run_key(run_name, g) in self.done and self.done[run_key(run_name, g)] != fingerprint(g)
+            for g in range(1, num_generations + 1)
+        )
+
+    def record_run(self, run_name: str, run_id: str):
+        self._append({"event": "run_started", "run_name": run_name, "run_id": run_id})
+
+    def record_generation(self, run_name: str, run_id: str, gen: int, fingerprint: str | None = None):
+        self._append({"event": "generation", "run_name": run_name, "run_id": run_id, "gen": gen,
+                      "fingerprint": fingerprint})
+
+    def record_closed(self, run_id: str, status: str):
+        self._append({"event": "run_closed", "run_id": run_id, "status": status})
+
+    # Ricostruisce l'indice dall'esperimento MLflow: una generazione e' completata
+    # se la run contiene l'artifact output_<prompt>_gen_<n>.txt; l'impronta viene dal tag
+    # generation_key_gen_<n>. Le run sostituite (tag supersedes_run_id) sono ignorate.
+    @classmethod
+    def from_mlflow(cls, path: str, client: MlflowClient, experiment_id: str) -> "CompletionIndex":
+        index = cls(path)
+        pattern = re.compile(r"output_.+_gen_(\d+)\.txt$")
+        runs = client.search_runs([experiment_id], max_results=50000)
+        # Run sostituite da una nuova run con lo stesso nome (configurazione cambiata)
+        superseded = {run.data.tags.get("supersedes_run_id") for run in runs}
+        for run in runs:
+            if run.data.tags.get("run_type") == "inputs" or run.info.run_id in superseded:
+                continue
+            run_name = run.info.run_name
+            run_id = run.info.run_id
+            if run_name in index.run_ids and index.run_ids[run_name] != run_id:
+                continue
+            for artifact in client.list_artifacts(run_id):
+                match = pattern.match(artifact.path)
+                if match and not index.is_done(run_name, int(match.group(1))):
+                    gen = int(match.group(1))
+                    index.record_generation(run_name, run_id, gen, run.data.tags.get(f"generation_key_gen_{gen}"))
+        return index
@@ -0,0 +1,182 @@
+import asyncio
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+import httpx
+
+
+def endpoint_slug(url: str) -> str:
+    return re.sub(r"[^\w]+", "_", url.split("://")[-1]).strip("_")
+
+
+@dataclass
+class Endpoint:
+    url: str
+    healthy: bool = True
+    outstanding: int = 0
+    requests: int = 0
+    failures: int = 0
+    completion_tokens: int = 0
+    busy_time: float = 0.0       # somma delle durate delle chiamate servite
+    first_start: float = 0.0
+    last_end: float = 0.0
+    last_check: float = 0.0
+
+    @property
+    def slug(self) -> str:
+        return endpoint_slug(self.url)
+
+    # Token generati al secondo nell'intervallo in cui l'endpoint ha lavorato
+    @property
+    def tokens_per_second(self) -> float:
+        span = self.last_end - self.first_start
+        return self.completion_tokens / span if span > 0 else 0.0
+
+    def stats(self) -> dict:
+        span = self.last_end - self.first_start
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "completion_tokens": self.completion_tokens,
+            "busy_time": self.busy_time,
+            "tokens_per_second": self.tokens_per_second,
+            "generations_per_minute": self.requests / span * 60 if span > 0 else 0.0,
+        }
+
+
+# Errori dovuti all'endpoint (non raggiungibile, timeout, errore 5xx o 429) e non alla
+# richiesta: solo questi spostano la cella su un altro server
+def is_endpoint_error(exc: BaseException) -> bool:
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, (httpx.TransportError, ConnectionError, asyncio.TimeoutError)):
+            return True
+        if type(exc).__name__ in ("APIConnectionError", "APITimeoutError"):
+            return True
+        status = getattr(exc, "status_code", None)
+        if isinstance(status, int) and (status >= 500 or status == 429):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+# Pool di server Ollama. Ogni chiamata va all'endpoint sano con meno richieste in volo
+# (a parita', quello che ne ha servite meno); se fallisce per un errore dell'endpoint
+# questo viene marcato non sano e la chiamata riprova su un altro. Gli endpoint non sani
+# vengono ricontrollati (GET /api/version) al piu' ogni `health_interval` secondi.
+class EndpointPool:
+    def __init__(self, urls: list[str], health_interval: float = 10.0, max_attempts: int | None = None,
+                 timeout: float = 5.0):
+        self.endpoints = [Endpoint(url.rstrip("/")) for url in dict.fromkeys(urls)]
+        self.health_interval = health_interval
+        self.max_attempts = max_attempts or len(self.endpoints)
+        self.timeout = timeout
+        self.failovers = 0
+
+    @property
+    def urls(self) -> list[str]:
+        return [e.url for e in self.endpoints]
+
+    def healthy_urls(self) -> list[str]:
+        return [e.url for e in self.endpoints if e.healthy]
+
+    def _probe(self, endpoint: Endpoint, ok: bool):
+        if ok and not endpoint.healthy:
+            print(f"Endpoint back online: {endpoint.url}")
+        endpoint.healthy = ok
+        endpoint.last_check = time.monotonic()
+
+    # Controllo sincrono di tutti gli endpoint, da usare prima della sweep
+    def check_all(self) -> list[str]:
+        for endpoint in self.endpoints:
+            try:
+                ok = httpx.get(f"{endpoint.url}/api/version", timeout=self.timeout).status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            self._probe(endpoint, ok)
+        return self.healthy_urls()
+
+    async def _check(self, endpoint: Endpoint):
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout) as http:
+                ok = (await http.get(f"{endpoint.url}/api/version")).status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        self._probe(endpoint, ok)
+
+    def mark_unhealthy(self, endpoint: Endpoint, exc: BaseException):
+        endpoint.healthy = False
+        endpoint.last_check = time.monotonic()
+        print(f"Endpoint marked unhealthy: {endpoint.url}: {exc!r}")
+
+    async def acquire(self, exclude: set[str] = frozenset()) -> Endpoint:
+        now = time.monotonic()
+        stale = [e for e in self.endpoints if not e.healthy and now - e.last_check >= self.health_interval]
+        if stale:
+            await asyncio.gather(*(self._check(e) for e in stale))
+        candidates = [e for e in self.endpoints if e.healthy and e.url not in exclude]
+        if not candidates:
+            # Nessun endpoint sano: ricontrolla subito quelli non ancora provati
+            untried = [e for e in self.endpoints if e.url not in exclude]
+            await asyncio.gather(*(self._check(e) for e in untried))
+            candidates = [e for e in untried if e.healthy]
+        if not candidates:
+            raise ConnectionError(f"No healthy Ollama endpoint among {self.urls}")
+        endpoint = min(candidates, key=lambda e: (e.outstanding, e.requests))
+        endpoint.outstanding += 1
+        return endpoint
+
+    # Esegue `call(url)` con failover: al massimo max_attempts endpoint diversi
+    async def run(self, call: Callable[[str], Awaitable[Any]]) -> tuple[Any, str]:
+        tried = set()
+        last_exc = None
+        for attempt in range(self.max_attempts):
+            endpoint = await self.acquire(tried)
+            if attempt:
+                self.failovers += 1
+            start = time.perf_counter()
+            if not endpoint.first_start:
+                endpoint.first_start = start
+            try:
+                result = await call(endpoint.url)
+            except Exception as exc:
+                if not is_endpoint_error(exc):
+                    raise
+                endpoint.failures += 1
+                self.mark_unhealthy(endpoint, exc)
+                tried.add(endpoint.url)
+                last_exc = exc
+                continue
+            finally:
+                endpoint.outstanding -= 1
+            end = time.perf_counter()
+            endpoint.requests += 1
+            endpoint.busy_time += end - start
+            endpoint.last_end = end
+            return result, endpoint.url
+        raise last_exc
+
+    def record_tokens(self, url: str, tokens: int):
+        for endpoint in self.endpoints:
+            if endpoint.url == url:
+                endpoint.completion_tokens += tokens
+
+    def reset_stats(self):
+        for endpoint in self.endpoints:
+            endpoint.requests = endpoint.failures = endpoint.completion_tokens = 0
+            endpoint.busy_time = endpoint.first_start = endpoint.last_end = 0.0
+        self.failovers = 0
+
+    def summary(self) -> str:
+        lines = [f"Endpoint pool: {len(self.endpoints)} endpoints, {self.failovers} failovers"]
+        for e in self.endpoints:
+            s = e.stats()
+            lines.append(
+                f"  {e.url:<28} healthy={e.healthy!s:<5} requests={s['requests']:>4} "
+                f"failures={s['failures']:>3} tokens/s={s['tokens_per_second']:7.1f} "
+                f"gen/min={s['generations_per_minute']:6.1f}"
+            )
+        return "\n".join(lines)
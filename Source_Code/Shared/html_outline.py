@@ -0,0 +1,182 @@
+import hashlib
+import os
+import re
+from html.parser import HTMLParser
+
+OUTLINE_VERSION = 1
+SKIP_TAGS = {"script", "style", "svg", "noscript", "template"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# Categorie in ordine di priorita': sotto budget si tagliano prima le ultime
+CATEGORIES = ["headings", "buttons", "inputs", "tables", "navigation", "text"]
+LABELS = {
+    "headings": "Headings",
+    "buttons": "Buttons",
+    "inputs": "Form fields",
+    "tables": "Tables",
+    "navigation": "Navigation",
+    "text": "Other text",
+}
+# Indizi nei nomi dei layer (export Figma), nelle classi e nei ruoli
+HINTS = [
+    ("buttons", re.compile(r"button|btn|fab|chip", re.I)),
+    ("inputs", re.compile(r"input|text.?field|dropdown|select|checkbox|radio|upload|search|form", re.I)),
+    ("tables", re.compile(r"table|cell|data.?grid|list.?item", re.I)),
+    ("navigation", re.compile(r"nav|menu|sidebar|tab|breadcrumb|link", re.I)),
+    ("headings", re.compile(r"title|header|headline|heading", re.I)),
+]
+# Sezione e frase della Request che nei template parlano degli screenshot
+SCREENSHOTS_HEADER = "[Screenshots]\n"
+HTML_HEADER = "[HTML outline]\n"
+EXPLORE_RE = re.compile(r"explore the screen?shots of the user interfaces", re.I)
+
+
+def estimate_tokens(text: str) -> int:
+    # Stima grossolana (circa 4 caratteri per token per testo inglese)
+    return max(1, len(text) // 4)
+
+
+def _category(tag: str, attrs: dict) -> str | None:
+    if tag in ("h1", "h2", "h3", "h4", "h5", "h6", "title"):
+        return "headings"
+    if tag == "button" or attrs.get("role") == "button" or attrs.get("type") in ("submit", "button"):
+        return "buttons"
+    if tag in ("input", "select", "textarea", "label", "form", "option"):
+        return "inputs"
+    if tag in ("table", "th", "thead", "tr", "td"):
+        return "tables"
+    if tag in ("a", "nav"):
+        return "navigation"
+    hint = " ".join(filter(None, [attrs.get("data-layer"), attrs.get("class"), attrs.get("role")]))
+    for category, pattern in HINTS:
+        if hint and pattern.search(hint):
+            return category
+    return None
+
+
+# Estrae da una pagina HTML il testo visibile classificato per tipo di elemento,
+# usando il tag, il ruolo o il nome del layer dell'antenato piu' vicino
+class _OutlineParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.items = {c: [] for c in CATEGORIES}
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: v or "" for k, v in attrs}
+        category = _category(tag, attrs)
+        if tag == "input" and attrs.get("type") != "hidden":
+            text = attrs.get("placeholder") or attrs.get("aria-label") or attrs.get("name") or attrs.get("value")
+            if text:
+                self._add(category or "inputs", f"{text} ({attrs.get('type', 'text')})")
+        if tag in VOID_TAGS:
+            return
+        if tag in SKIP_TAGS:
+            self.skip += 1
+        self.stack.append((tag, category))
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                for closed, _ in self.stack[i:]:
+                    if closed in SKIP_TAGS:
+                        self.skip -= 1
+                del self.stack[i:]
+                return
+
+    def handle_data(self, data):
+        text = " ".join(data.split())
+        if not text or self.skip or len(text) < 2:
+            return
+        in_head = any(tag == "head" for tag, _ in self.stack)
+        category = next((c for _, c in reversed(self.stack) if c), None)
+        if in_head and category != "headings":
+            return
+        self._add(category or "text", text)
+
+    def _add(self, category: str, text: str):
+        items = self.items[category]
+        if text not in items:
+            items.append(text)
+
+
+def parse_page(html: str) -> dict[str, list[str]]:
+    parser = _OutlineParser()
+    parser.feed(html)
+    parser.close()
+    return parser.items
+
+
+def _render(pages: dict[str, dict], common: list[str], limits: dict[str, int]) -> str:
+    lines = []
+    if common:
+        lines.append("Common navigation: " + " | ".join(common))
+    for page, items in pages.items():
+        lines.append(f"Page: {page}")
+        for category in CATEGORIES:
+            values = items[category][: limits[category]]
+            if values:
+                lines.append(f"  {LABELS[category]}: " + " | ".join(values))
+    return "\n".join(lines)
+
+
+# Outline compatto di tutte le pagine: le voci di navigazione presenti in ogni pagina
+# vengono riportate una sola volta; se si supera token_budget si riduce il numero di
+# voci per categoria partendo da quelle meno importanti (testo libero, navigazione...).
+def build_outline(paths: list[str], token_budget: int = 2000) -> str:
+    pages = {}
+    for path in sorted(paths):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            name = os.path.splitext(os.path.basename(path))[0]
+            pages[name] = parse_page(f.read())
+
+    common = []
+    if len(pages) > 1:
+        shared = set.intersection(*(set(p["navigation"]) for p in pages.values()))
+        common = [n for n in next(iter(pages.values()))["navigation"] if n in shared]
+        for items in pages.values():
+            items["navigation"] = [n for n in items["navigation"] if n not in shared]
+
+    limits = {c: max((len(p[c]) for p in pages.values()), default=0) for c in CATEGORIES}
+    outline = _render(pages, common, limits)
+    for category in reversed(CATEGORIES):
+        while estimate_tokens(outline) > token_budget and limits[category] > 0:
+            limits[category] = limits[category] // 2 if limits[category] > 4 else limits[category] - 1
+            outline = _render(pages, common, limits)
+        if estimate_tokens(outline) <= token_budget:
+            break
+    return outline
+
+
+# Testo del template per la modalita' "html": la sezione con l'outline e la Request parlano
+# delle pagine HTML e non di screenshot che il modello non riceve
+def html_prompt(template_text: str) -> str:
+    text = template_text.replace(SCREENSHOTS_HEADER, HTML_HEADER)
+    return EXPLORE_RE.sub("explore the outline of the user interface pages", text)
+
+
+def load_html_paths(folder: str) -> list[str]:
+    return sorted(
+        os.path.join(folder, fname)
+        for fname in os.listdir(folder)
+        if os.path.splitext(fname.lower())[1] in (".html", ".htm")
+    )
+
+
+# Outline con cache su disco, chiave = contenuto dei file HTML + budget + versione
+def cached_outline(folder: str, token_budget: int = 2000, cache_dir: str = ".cache/html_outline") -> str:
+    paths = load_html_paths(folder)
+    digest = hashlib.sha256(f"v{OUTLINE_VERSION}:{token_budget}".encode("utf-8"))
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(os.path.basename(path).encode("utf-8"))
+            digest.update(hashlib.sha256(f.read()).digest())
+    cache_path = os.path.join(cache_dir, f"{digest.hexdigest()}.txt")
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            return f.read()
+    outline = build_outline(paths, token_budget)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_path, "w", encoding="utf-8") as f:
+        f.write(outline)
+    return outline
@@ -0,0 +1,88 @@
+import base64
+import hashlib
+import io
+import json
+import os
+
+from PIL import Image
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+from response_cache import file_sha256
+
+IMAGE_SENTINEL = "\x00IMAGES\x00"
+
+
+# Carica lo screenshot, lo ridimensiona entro max_side pixel e lo ricomprime.
+# Il blob base64 viene salvato su disco con chiave (hash del file, impostazioni),
+# quindi le sweep successive non decodificano/ricodificano nulla.
+def encode_image(
+    path: str,
+    max_side: int = 1024,
+    fmt: str = "JPEG",
+    quality: int = 85,
+    cache_dir: str = ".cache/images",
+) -> dict:
+    fmt = fmt.upper()
+    settings = f"{file_sha256(path)}:{max_side}:{fmt}:{quality}"
+    key = hashlib.sha256(settings.encode("utf-8")).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{key}.json")
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    with Image.open(path) as img:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        save_kwargs = {"optimize": True}
+        if fmt in ("JPEG", "WEBP"):
+            save_kwargs["quality"] = quality
+        img.save(buffer, format=fmt, **save_kwargs)
+        width, height = img.size
+
+    raw = buffer.getvalue()
+    blob = {
+        "key": key,
+        "source": os.path.basename(path),
+        "mime": Image.MIME.get(fmt, f"image/{fmt.lower()}"),
+        "data": base64.b64encode(raw).decode("ascii"),
+        "width": width,
+        "height": height,
+        "bytes": len(raw),
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(blob, f)
+    os.replace(tmp, cache_path)
+    return blob
+
+
+def encode_images(paths: list[str], **kwargs) -> list[dict]:
+    return [encode_image(p, **kwargs) for p in paths]
+
+
+# Parti "image_url" (data URL) nel formato multimodale OpenAI accettato da Ollama
+def image_message_parts(blobs: list[dict]) -> list[dict]:
+    return [
+        {"type": "image_url", "image_url": {"url": f"data:{b['mime']};base64,{b['data']}"}}
+        for b in blobs
+    ]
+
+
+# Trasforma il PromptTemplate testuale in un messaggio multimodale: il testo prima e
+# dopo lo slot {image} diventa parte "text", le immagini vengono inserite nel mezzo.
+def multimodal_messages(template: PromptTemplate, image_parts: list[dict]) -> list[HumanMessage]:
+    before, _, after = template.format(image=IMAGE_SENTINEL).partition(IMAGE_SENTINEL)
+    content = [{"type": "text", "text": before}, *image_parts]
+    if after.strip():
+        content.append({"type": "text", "text": after})
+    return [HumanMessage(content=content)]
+
+
+# Runnable da mettere davanti al modello al posto del template: riceve {"image": parts}
+def multimodal_prompt(template: PromptTemplate) -> RunnableLambda:
+    return RunnableLambda(lambda inputs: multimodal_messages(template, inputs["image"]))
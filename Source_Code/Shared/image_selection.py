@@ -0,0 +1,235 @@
+import hashlib
+import json
+import math
+import os
+import re
+from dataclasses import dataclass, field
+
+from PIL import Image, ImageChops
+
+from response_cache import file_sha256
+
+CACHE_DIR = os.path.join(".cache", "image_selection")
+
+
+# Ordine deterministico per nome file, con i numeri confrontati come numeri (a parita' di
+# nome resta l'ordine delle cartelle, quindi tra copie identiche vince la prima cartella)
+def natural_key(path: str) -> tuple:
+    parts = re.split(r"(\d+)", os.path.basename(path).lower())
+    return tuple(int(p) if p.isdigit() else p for p in parts)
+
+
+# Difference hash: ogni bit dice se un pixel della miniatura in scala di grigi e' piu'
+# chiaro del vicino a destra. Con hash_size=16 (256 bit) schermate diverse dello stesso
+# layout restano distinguibili, con 8 bit per lato spesso collidono.
+def dhash(img: Image.Image, hash_size: int = 16) -> int:
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    px = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            i = row * (hash_size + 1) + col
+            value = value << 1 | (px[i] > px[i + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# Hash percettivo e dimensioni di ogni immagine, in cache per hash del file
+def fingerprints(paths: list[str], hash_size: int = 16, cache_dir: str = CACHE_DIR) -> dict[str, dict]:
+    cache_path = os.path.join(cache_dir, f"dhash_{hash_size}.json")
+    cached = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            cached = json.load(f)
+    result = {}
+    dirty = False
+    for path in paths:
+        sha = file_sha256(path)
+        if sha not in cached:
+            with Image.open(path) as img:
+                cached[sha] = {"dhash": f"{dhash(img, hash_size):x}", "width": img.width, "height": img.height}
+            dirty = True
+        result[path] = {"sha256": sha, "dhash": int(cached[sha]["dhash"], 16),
+                        "width": cached[sha]["width"], "height": cached[sha]["height"]}
+    if dirty:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cached, f)
+        os.replace(tmp, cache_path)
+    return result
+
+
+# Riquadro (in pixel di `other`) dove le due schermate differiscono, confrontandole su una
+# griglia di `cols` colonne in scala di grigi; None se non differiscono
+def changed_box(base: str, other: str, cols: int = 128, threshold: int = 32) -> tuple | None:
+    with Image.open(base) as a, Image.open(other) as b:
+        rows = max(1, round(cols * a.height / a.width))
+        grid_a = a.convert("L").resize((cols, rows), Image.BOX)
+        grid_b = b.convert("L").resize((cols, rows), Image.BOX)
+        width, height = b.size
+    mask = ImageChops.difference(grid_a, grid_b).point(lambda v: 255 if v > threshold else 0)
+    box = mask.getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    return (left * width // cols, top * height // rows,
+            math.ceil(right * width / cols), math.ceil(bottom * height / rows))
+
+
+# Distanza (frazione dei bit) tra i dhash della stessa zona nelle due schermate; `box` e'
+# in pixel di `other` e viene riportato sulle dimensioni di `base`
+def region_distance(base: str, other: str, box: tuple, hash_size: int = 16) -> float:
+    with Image.open(base) as a, Image.open(other) as b:
+        sx, sy = a.width / b.width, a.height / b.height
+        region_a = a.crop((int(box[0] * sx), int(box[1] * sy), math.ceil(box[2] * sx), math.ceil(box[3] * sy)))
+        region_b = b.crop(box)
+        return hamming(dhash(region_a, hash_size), dhash(region_b, hash_size)) / hash_size ** 2
+
+
+# Schermate confrontabili: stesso rapporto d'aspetto entro `tolerance`
+def same_shape(a: dict, b: dict, tolerance: float = 0.02) -> bool:
+    return abs(a["width"] / a["height"] - b["width"] / b["height"]) <= tolerance * b["width"] / b["height"]
+
+
+# Allarga il riquadro di `margin` (frazione del lato) e almeno fino a min_side del lato,
+# cosi' la parte ritagliata conserva un po' del contesto della schermata
+def expand_box(box: tuple, size: tuple, margin: float = 0.05, min_side: float = 0.25) -> tuple:
+    expanded = []
+    for lo, hi, side in ((box[0], box[2], size[0]), (box[1], box[3], size[1])):
+        lo, hi = lo - margin * side, hi + margin * side
+        grow = max(0.0, min_side * side - (hi - lo)) / 2
+        lo, hi = lo - grow, hi + grow
+        shift = max(0.0, -lo) - max(0.0, hi - side)
+        expanded.append((max(0, int(lo + shift)), min(side, math.ceil(hi + shift))))
+    (left, right), (top, bottom) = expanded
+    return left, top, right, bottom
+
+
+def crop_image(path: str, box: tuple, cache_dir: str = CACHE_DIR) -> str:
+    key = hashlib.sha256(f"{file_sha256(path)}:{box}".encode("utf-8")).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    crop_path = os.path.join(cache_dir, "crops", f"{stem}_crop_{key}.png")
+    if not os.path.exists(crop_path):
+        os.makedirs(os.path.dirname(crop_path), exist_ok=True)
+        tmp = f"{crop_path}.{os.getpid()}.tmp"
+        with Image.open(path) as img:
+            img.crop(box).save(tmp, format="PNG", optimize=True)
+        os.replace(tmp, crop_path)
+    return crop_path
+
+
+# Token stimati per un'immagine ridotta entro max_side e divisa in patch di patch_px pixel
+# (la stessa granularita' della stima per qwen2.5vl in token_profiler.py)
+def image_tokens(width: int, height: int, max_side: int = 1024, patch_px: int = 28) -> int:
+    scale = min(1.0, max_side / max(width, height))
+    return math.ceil(width * scale / patch_px) * math.ceil(height * scale / patch_px)
+
+
+@dataclass
+class ImageSelection:
+    paths: list[str]
+    # path inviato -> schermata originale (diverso solo per i ritagli)
+    sources: dict[str, str] = field(default_factory=dict)
+    # schermata scartata -> motivo
+    dropped: dict[str, str] = field(default_factory=dict)
+    tokens: int = 0
+
+    def summary(self) -> str:
+        crops = sum(1 for p in self.paths if self.sources[p] != p)
+        copies = sum(1 for reason in self.dropped.values() if reason.startswith("same file"))
+        lines = [f"Images: {len(self.paths)} sent ({crops} cropped), {len(self.dropped)} dropped "
+                 f"({copies} identical copies), ~{self.tokens} image tokens"]
+        for path in self.paths:
+            if self.sources[path] != path:
+                lines.append(f"  cropped  {os.path.basename(self.sources[path])}")
+        for path, reason in self.dropped.items():
+            if not reason.startswith("same file"):
+                lines.append(f"  dropped  {os.path.basename(path)}: {reason}")
+        return "\n".join(lines)
+
+
+# Seleziona gli screenshot da inviare:
+#   - ordine deterministico (natural_key) e copie identiche (stesso hash del file) scartate;
+#   - una schermata e' un quasi-duplicato di una gia' scelta se ha lo stesso rapporto
+#     d'aspetto (entro aspect_tolerance), il suo dhash dista al massimo max_distance
+#     (frazione dei bit) e anche la zona che cambia, confrontata da sola, dista al massimo
+#     max_distance: pagine diverse con lo stesso sfondo o la stessa cornice (Login e
+#     SignUp) differiscono poco nel complesso ma molto nella zona che cambia, e restano
+#     intere. Un quasi-duplicato con near_duplicates="crop" viene ritagliato sulla zona che
+#     cambia (se la zona non supera max_crop_area della schermata, altrimenti resta
+#     intero), con "collapse" scartato, con "keep" inviato intero; se non cambia nulla
+#     viene scartato. Il default di max_distance separa le coppie di stati della stessa
+#     pagina dei prototipi (classified-cells-correct/wrong a 0.17) da Login/SignUp (zona
+#     che cambia a 0.31);
+#   - max_images e token_budget limitano il prompt: prima le schermate intere in ordine,
+#     poi i ritagli; ogni ritaglio viene inviato subito dopo la sua schermata di base.
+def select_images(paths: list[str], near_duplicates: str = "crop", max_distance: float = 0.2,
+                  max_images: int | None = None, token_budget: int | None = None,
+                  max_side: int = 1024, patch_px: int = 28, hash_size: int = 16,
+                  cols: int = 128, threshold: int = 32, max_crop_area: float = 0.5,
+                  aspect_tolerance: float = 0.02, cache_dir: str = CACHE_DIR) -> ImageSelection:
+    if near_duplicates not in ("crop", "collapse", "keep"):
+        raise ValueError(f"Unknown near_duplicates mode: {near_duplicates}")
+    ordered = sorted(paths, key=natural_key)
+    info = fingerprints(ordered, hash_size, cache_dir)
+    dropped = {}
+    seen = {}
+    bases = []
+    crops = {}
+    for path in ordered:
+        sha = info[path]["sha256"]
+        if sha in seen:
+            dropped[path] = f"same file as {seen[sha]}"
+            continue
+        seen[sha] = path
+        distances = [(hamming(info[path]["dhash"], info[b]["dhash"]), b) for b in bases
+                     if same_shape(info[path], info[b], aspect_tolerance)]
+        distance, base = min(distances, default=(None, None))
+        if base is None or distance > max_distance * hash_size ** 2 or near_duplicates == "keep":
+            bases.append(path)
+            continue
+        box = changed_box(base, path, cols, threshold)
+        if box is None:
+            dropped[path] = f"same screen as {os.path.basename(base)}"
+            continue
+        size = (info[path]["width"], info[path]["height"])
+        box = expand_box(box, size)
+        if region_distance(base, path, box, hash_size) > max_distance:
+            bases.append(path)
+            continue
+        if near_duplicates == "collapse":
+            dropped[path] = f"near-duplicate of {os.path.basename(base)}"
+            continue
+        if (box[2] - box[0]) * (box[3] - box[1]) > max_crop_area * size[0] * size[1]:
+            bases.append(path)
+            continue
+        crops.setdefault(base, []).append((crop_image(path, box, cache_dir), path, box))
+
+    # Budget: le schermate intere hanno la precedenza sui ritagli
+    def tokens(width, height):
+        return image_tokens(width, height, max_side, patch_px)
+
+    candidates = [(b, b, None, tokens(info[b]["width"], info[b]["height"])) for b in bases]
+    candidates += [(crop, source, base, tokens(box[2] - box[0], box[3] - box[1]))
+                   for base in bases for crop, source, box in crops.get(base, [])]
+    chosen = {}
+    total = 0
+    for sent, source, base, cost in candidates:
+        if (max_images is not None and len(chosen) >= max_images) \
+                or (token_budget is not None and total + cost > token_budget) \
+                or (base is not None and base not in chosen):
+            dropped[source] = "over the image budget"
+            continue
+        chosen[sent] = source
+        total += cost
+
+    selected = []
+    for base in bases:
+        if base in chosen:
+            selected.append(base)
+            selected += [crop for crop, _, _ in crops.get(base, []) if crop in chosen]
+    return ImageSelection(selected, {p: chosen[p] for p in selected}, dropped, total)
@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+LOG_DIR = os.path.join(".cache", "runlog")
+FILTER_RE = re.compile(r"(tags|attributes|params)\.(\w+)\s*=\s*'([^']*)'")
+
+
+# Tracking senza server: run, parametri, metriche e tag vengono scritti come record JSON
+# in un log append-only (runs.jsonl), gli artifact come file in artifacts/<run_id>/.
+# Il log viene sincronizzato su disco (fsync) ogni `fsync_every` record o `fsync_interval`
+# secondi invece che a ogni scrittura. Espone il sottoinsieme dell'API di MlflowClient
+# usato dalla sweep, quindi puo' prendere il posto del client in SweepTracker.
+class RunLog:
+    def __init__(self, root: str, fsync_every: int = 200, fsync_interval: float = 2.0):
+        self.root = root
+        self.name = os.path.basename(os.path.normpath(root))
+        self.log_path = os.path.join(root, "runs.jsonl")
+        self.artifact_root = os.path.join(root, "artifacts")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(self.artifact_root, exist_ok=True)
+        self._file = open(self.log_path, "a", encoding="utf-8")
+
+    @property
+    def experiment(self) -> SimpleNamespace:
+        return SimpleNamespace(experiment_id=self.name, name=self.name)
+
+    def get_experiment_by_name(self, name: str) -> SimpleNamespace:
+        return self.experiment
+
+    # --- scrittura -----------------------------------------------------------------
+    def _append(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._pending += 1
+            if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def create_run(self, experiment_id: str, run_name: str | None = None, tags: dict | None = None,
+                   start_time: int | None = None) -> SimpleNamespace:
+        run_id = uuid.uuid4().hex
+        self._append({
+            "op": "create_run", "run_id": run_id, "run_name": run_name, "tags": tags or {},
+            "start_time": start_time or int(time.time() * 1000),
+        })
+        return SimpleNamespace(info=SimpleNamespace(run_id=run_id, run_name=run_name))
+
+    def log_batch(self, run_id: str, metrics=(), params=(), tags=()):
+        self._append({
+            "op": "log_batch", "run_id": run_id,
+            "metrics": [[m.key, m.value, m.timestamp, m.step] for m in metrics],
+            "params": [[p.key, p.value] for p in params],
+            "tags": [[t.key, t.value] for t in tags],
+        })
+
+    def set_tag(self, run_id: str, key: str, value):
+        self._append({"op": "log_batch", "run_id": run_id, "metrics": [], "params": [],
+                      "tags": [[key, str(value)]]})
+
+    def update_run(self, run_id: str, status: str | None = None, name: str | None = None):
+        self._append({"op": "update_run", "run_id": run_id, "status": status, "run_name": name})
+
+    def set_terminated(self, run_id: str, status: str = "FINISHED", end_time: int | None = None):
+        self._append({"op": "set_terminated", "run_id": run_id, "status": status,
+                      "end_time": end_time or int(time.time() * 1000)})
+
+    # Gli output sono pochi e grandi: ognuno viene sincronizzato subito, prima che il
+    # record nel log lo dichiari scritto. Anche il record (e quelli ancora in attesa
+    # scritti prima, come il tag generation_key) viene sincronizzato prima di tornare,
+    # cosi' l'indice di completamento non registra mai una generazione assente dal log.
+    def _write_artifact(self, run_id: str, artifact_file: str, data: bytes):
+        path = os.path.join(self.artifact_root, run_id, artifact_file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self._append({"op": "artifact", "run_id": run_id, "path": artifact_file})
+        self.flush()
+
+    def log_text(self, run_id: str, text: str, artifact_file: str):
+        self._write_artifact(run_id, artifact_file, text.encode("utf-8"))
+
+    def log_dict(self, run_id: str, dictionary, artifact_file: str):
+        self._write_artifact(run_id, artifact_file, json.dumps(dictionary, indent=2).encode("utf-8"))
+
+    def log_artifact(self, run_id: str, local_path: str, artifact_path: str | None = None):
+        with open(local_path, "rb") as f:
+            data = f.read()
+        name = os.path.basename(local_path)
+        self._write_artifact(run_id, f"{artifact_path}/{name}" if artifact_path else name, data)
+
+    # --- lettura (stato ricostruito dal log) --------------------------------------------
+    def runs(self) -> dict[str, dict]:
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+        return replay(self.log_path)
+
+    def search_runs(self, experiment_ids: list[str], filter_string: str = "", max_results: int = 1000, **kwargs) -> list:
+        conditions = FILTER_RE.findall(filter_string)
+        matches = []
+        for state in self.runs().values():
+            fields = {"tags": state["tags"], "params": state["params"],
+                      "attributes": {"status": state["status"], "run_name": state["run_name"]}}
+            if all(fields[kind].get(key) == value for kind, key, value in conditions):
+                matches.append(_as_run(state))
+        return matches[:max_results]
+
+    def list_artifacts(self, run_id: str, path: str | None = None) -> list:
+        state = self.runs().get(run_id)
+        artifacts = state["artifacts"] if state else []
+        prefix = f"{path.rstrip('/')}/" if path else ""
+        return [SimpleNamespace(path=a, is_dir=False) for a in artifacts if a.startswith(prefix)]
+
+    def download_artifacts(self, run_id: str, path: str, dst_path: str | None = None) -> str:
+        return os.path.join(self.artifact_root, run_id, path)
+
+
+def _as_run(state: dict) -> SimpleNamespace:
+    return SimpleNamespace(
+        info=SimpleNamespace(run_id=state["run_id"], run_name=state["run_name"], status=state["status"],
+                             start_time=state["start_time"], end_time=state["end_time"]),
+        data=SimpleNamespace(tags=state["tags"], params=state["params"],
+                             metrics={k: v[-1][0] for k, v in state["metrics"].items()}),
+    )
+
+
+# Stato di ogni run ricostruito rileggendo il log dall'inizio. Una riga troncata in coda
+# (interruzione durante la scrittura) viene ignorata.
+def replay(log_path: str) -> dict[str, dict]:
+    runs = {}
+    if not os.path.exists(log_path):
+        return runs
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            run_id = record["run_id"]
+            if record["op"] == "create_run":
+                runs[run_id] = {
+                    "run_id": run_id, "run_name": record["run_name"], "tags": dict(record["tags"]),
+                    "params": {}, "metrics": {}, "artifacts": [], "status": "RUNNING",
+                    "start_time": record["start_time"], "end_time": None,
+                }
+                continue
+            state = runs.get(run_id)
+            if state is None:
+                continue
+            if record["op"] == "log_batch":
+                state["params"].update(dict(record["params"]))
+                state["tags"].update(dict(record["tags"]))
+                for key, value, timestamp, step in record["metrics"]:
+                    state["metrics"].setdefault(key, []).append((value, timestamp, step))
+            elif record["op"] == "artifact":
+                if record["path"] not in state["artifacts"]:
+                    state["artifacts"].append(record["path"])
+            elif record["op"] == "update_run":
+                if record.get("status"):
+                    state["status"] = record["status"]
+                    state["end_time"] = None
+                if record.get("run_name"):
+                    state["run_name"] = record["run_name"]
+            elif record["op"] == "set_terminated":
+                state["status"] = record["status"]
+                state["end_time"] = record["end_time"]
+    return runs
+
+
+# Riversa il log locale in un esperimento MLflow. Le run gia' importate (imported.json)
+# vengono saltate, quelle ancora in corso vengono importate solo con include_running.
+# Tag e parametri che riferiscono un'altra run del log (es. il tag input_images_run_id)
+# vengono riscritti con l'id MLflow corrispondente: per questo le run di servizio (run_type)
+# vengono importate per prime.
+def import_log(root: str, tracking_uri: str, experiment_name: str | None = None,
+               include_running: bool = False) -> int:
+    import mlflow
+    from mlflow.entities import Metric, Param
+    from mlflow.tracking import MlflowClient
+
+    from tracking import MAX_METRICS_PER_BATCH, MAX_PARAMS_PER_BATCH
+
+    mlflow.set_tracking_uri(tracking_uri)
+    experiment = mlflow.set_experiment(experiment_name or os.path.basename(os.path.normpath(root)))
+    client = MlflowClient()
+    imported_path = os.path.join(root, "imported.json")
+    imported = {}
+    if os.path.exists(imported_path):
+        with open(imported_path, encoding="utf-8") as f:
+            imported = json.load(f)
+
+    count = 0
+    runs = replay(os.path.join(root, "runs.jsonl"))
+    for run_id, state in sorted(runs.items(), key=lambda item: "run_type" not in item[1]["tags"]):
+        if run_id in imported or (state["status"] == "RUNNING" and not include_running):
+            continue
+        tags = {k: imported.get(v, v) for k, v in state["tags"].items()}
+        run = client.create_run(experiment.experiment_id, start_time=state["start_time"],
+                                tags=tags, run_name=state["run_name"])
+        target = run.info.run_id
+        metrics = [Metric(k, v, ts, step) for k, values in state["metrics"].items() for v, ts, step in values]
+        params = [Param(k, imported.get(v, v)) for k, v in state["params"].items()]
+        for i in range(0, len(metrics), MAX_METRICS_PER_BATCH):
+            client.log_batch(target, metrics=metrics[i:i + MAX_METRICS_PER_BATCH])
+        for i in range(0, len(params), MAX_PARAMS_PER_BATCH):
+            client.log_batch(target, params=params[i:i + MAX_PARAMS_PER_BATCH])
+        for artifact in state["artifacts"]:
+            directory = os.path.dirname(artifact)
+            client.log_artifact(target, os.path.join(root, "artifacts", run_id, artifact),
+                                artifact_path=directory or None)
+        if state["status"] != "RUNNING":
+            client.set_terminated(target, state["status"], end_time=state["end_time"])
+        imported[run_id] = target
+        with open(imported_path, "w", encoding="utf-8") as f:
+            json.dump(imported, f, indent=2)
+        count += 1
+        print(f"Imported {state['run_name']} -> {target}")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local append-only run log")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="replay a local run log into an MLflow server")
+    imp.add_argument("root", help="log folder, e.g. .cache/runlog/<experiment>")
+    imp.add_argument("--tracking-uri", default="http://127.0.0.1:5000")
+    imp.add_argument("--experiment", default=None, help="defaults to the folder name")
+    imp.add_argument("--include-running", action="store_true", help="also import runs never terminated")
+    show = sub.add_parser("show", help="list the runs in a local run log")
+    show.add_argument("root")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        n = import_log(args.root, args.tracking_uri, args.experiment, args.include_running)
+        print(f"{n} runs imported")
+    else:
+        for state in replay(os.path.join(args.root, "runs.jsonl")).values():
+            print(f"{state['status']:<9} {state['run_name']:<60} params={len(state['params']):>3} "
+                  f"metrics={len(state['metrics']):>4} artifacts={len(state['artifacts']):>3}")
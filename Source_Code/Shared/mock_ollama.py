@@ -0,0 +1,287 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Risposta di esempio nel formato richiesto dallo STRUCTURE dei prompt
+DEFAULT_OUTPUT = (
+    "Reasoning\n"
+    "The screenshots show the main workflow of the system, so the tasks cover its core functions.\n\n"
+    "Tasks\n"
+    "- Find out which result the system proposes for the patient you have just examined.\n"
+    "- Check whether the explanation agrees with the highlighted areas.\n"
+    "- Ask for further clarification about the proposed result.\n"
+)
+# Stessa risposta per le richieste con schema JSON (format / response_format)
+STRUCTURED_OUTPUT = json.dumps({
+    "reasoning": "The screenshots show the main workflow of the system, so the tasks cover its core functions.",
+    "tasks": [
+        "Find out which result the system proposes for the patient you have just examined.",
+        "Check whether the explanation agrees with the highlighted areas.",
+        "Ask for further clarification about the proposed result.",
+    ],
+})
+
+
+# Stand-in OpenAI-compatibile di Ollama con latenza scriptata: time-to-first-token,
+# velocita' di decodifica e tempo di caricamento configurabili. Espone le API usate
+# dal runner (/v1/chat/completions, /api/chat, /v1/embeddings, /api/generate, /api/ps)
+# e /stats per leggere quante richieste ha servito.
+class MockOllama:
+    def __init__(self, host: str = "127.0.0.1", port: int = 11500, ttft: float = 0.2,
+                 tokens_per_second: float = 200.0, load_time: float = 0.5,
+                 output: str = DEFAULT_OUTPUT, prompt_tokens: int = 1500, embed_dim: int = 64):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.load_time = load_time
+        self.tokens = output.split(" ")
+        self.structured_tokens = STRUCTURED_OUTPUT.split(" ")
+        self.prompt_tokens = prompt_tokens
+        self.embed_dim = embed_dim
+        self.loaded = set()
+        self.lock = threading.Lock()
+        self.stats = {"chat": 0, "embeddings": 0, "loads": 0, "in_flight": 0, "max_in_flight": 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    @property
+    def completion_tokens(self) -> int:
+        return len(self.tokens)
+
+    # Durata minima di una chiamata non in streaming secondo lo script di latenza
+    @property
+    def scripted_latency(self) -> float:
+        return self.ttft + self.completion_tokens / self.tokens_per_second
+
+    # Token della risposta: in JSON se la richiesta porta uno schema
+    def output_tokens(self, body: dict) -> list[str]:
+        return self.structured_tokens if body.get("format") or body.get("response_format") else self.tokens
+
+    def start(self) -> "MockOllama":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {k: 0 for k in self.stats}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, payload: dict, status: int = 200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self) -> dict:
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                if self.path == "/api/ps":
+                    self._json({"models": [{"name": m} for m in sorted(mock.loaded)]})
+                elif self.path == "/stats":
+                    with mock.lock:
+                        self._json(dict(mock.stats))
+                elif self.path in ("/", "/api/version"):
+                    self._json({"version": "mock"})
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                body = self._body()
+                if self.path == "/api/generate":
+                    self._generate(body)
+                elif self.path == "/v1/chat/completions":
+                    self._chat(body)
+                elif self.path == "/api/chat":
+                    self._chat(body, native=True)
+                elif self.path == "/v1/embeddings":
+                    self._embeddings(body)
+                elif self.path == "/stats/reset":
+                    mock.reset_stats()
+                    self._json({})
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def _generate(self, body: dict):
+                model = body.get("model", "")
+                if body.get("keep_alive") == 0:
+                    mock.loaded.discard(model)
+                    self._json({"model": model, "done": True, "done_reason": "unload"})
+                    return
+                load = 0.0 if model in mock.loaded else mock.load_time
+                time.sleep(load)
+                mock.loaded.add(model)
+                with mock.lock:
+                    mock.stats["loads"] += 1
+                self._json({"model": model, "done": True, "load_duration": int(load * 1e9)})
+
+            def _chat(self, body: dict, native: bool = False):
+                with mock.lock:
+                    mock.stats["chat"] += 1
+                    mock.stats["in_flight"] += 1
+                    mock.stats["max_in_flight"] = max(mock.stats["max_in_flight"], mock.stats["in_flight"])
+                try:
+                    if native:
+                        self._native_chat(body)
+                    elif body.get("stream"):
+                        self._chat_stream(body)
+                    else:
+                        tokens = mock.output_tokens(body)
+                        time.sleep(mock.ttft + len(tokens) / mock.tokens_per_second)
+                        self._json({
+                            "id": "chatcmpl-mock",
+                            "object": "chat.completion",
+                            "created": int(time.time()),
+                            "model": body.get("model", ""),
+                            "choices": [{
+                                "index": 0,
+                                "message": {"role": "assistant", "content": " ".join(tokens)},
+                                "finish_reason": "stop",
+                            }],
+                            "usage": self._usage(len(tokens)),
+                        })
+                finally:
+                    with mock.lock:
+                        mock.stats["in_flight"] -= 1
+
+            def _usage(self, completion_tokens: int) -> dict:
+                return {
+                    "prompt_tokens": mock.prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": mock.prompt_tokens + completion_tokens,
+                }
+
+            def _chat_stream(self, body: dict):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                        "created": int(time.time()), "model": body.get("model", "")}
+
+                def send(payload):
+                    data = f"data: {payload}\n\n".encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                    self.wfile.flush()
+
+                tokens = mock.output_tokens(body)
+                time.sleep(mock.ttft)
+                delay = 1.0 / mock.tokens_per_second
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(delay)
+                    text = token if i == 0 else " " + token
+                    send(json.dumps({**base, "choices": [
+                        {"index": 0, "delta": {"role": "assistant", "content": text}, "finish_reason": None}
+                    ]}))
+                send(json.dumps({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    send(json.dumps({**base, "choices": [], "usage": self._usage(len(tokens))}))
+                send("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            # /api/chat nativo: NDJSON in streaming (default di Ollama) con le durate delle
+            # fasi nell'ultimo messaggio, come le restituisce il server reale
+            def _native_chat(self, body: dict):
+                model = body.get("model", "")
+                tokens = mock.output_tokens(body)
+                start = time.perf_counter()
+                load = 0.0 if model in mock.loaded else mock.load_time
+                time.sleep(load)
+                mock.loaded.add(model)
+                time.sleep(mock.ttft)
+                prompt_eval = time.perf_counter() - start - load
+                base = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+                def final(content: str) -> dict:
+                    eval_time = time.perf_counter() - start - load - prompt_eval
+                    return {
+                        **base,
+                        "message": {"role": "assistant", "content": content},
+                        "done": True,
+                        "done_reason": "stop",
+                        "total_duration": int((time.perf_counter() - start) * 1e9),
+                        "load_duration": int(load * 1e9),
+                        "prompt_eval_count": mock.prompt_tokens,
+                        "prompt_eval_duration": int(prompt_eval * 1e9),
+                        "eval_count": len(tokens),
+                        "eval_duration": int(eval_time * 1e9),
+                    }
+
+                if not body.get("stream", True):
+                    time.sleep(len(tokens) / mock.tokens_per_second)
+                    self._json(final(" ".join(tokens)))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send(payload: dict):
+                    data = (json.dumps(payload) + "\n").encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                    self.wfile.flush()
+
+                delay = 1.0 / mock.tokens_per_second
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(delay)
+                    text = token if i == 0 else " " + token
+                    send({**base, "message": {"role": "assistant", "content": text}, "done": False})
+                send(final(""))
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def _embeddings(self, body: dict):
+                inputs = body.get("input", [])
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                with mock.lock:
+                    mock.stats["embeddings"] += len(inputs)
+                data = []
+                for i, text in enumerate(inputs):
+                    # Vettore deterministico derivato dal testo
+                    digest = hashlib.sha256(text.encode("utf-8")).digest()
+                    vector = [digest[k % len(digest)] / 255.0 for k in range(mock.embed_dim)]
+                    data.append({"object": "embedding", "index": i, "embedding": vector})
+                self._json({"object": "list", "data": data, "model": body.get("model", ""),
+                            "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scripted OpenAI-compatible stand-in for Ollama")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tps", type=float, default=200.0, help="decoded tokens per second")
+    parser.add_argument("--load-time", type=float, default=0.5, help="seconds to 'load' a model")
+    args = parser.parse_args()
+
+    mock = MockOllama(args.host, args.port, args.ttft, args.tps, args.load_time)
+    print(f"Mock Ollama listening on {mock.url}")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.server.server_close()
@@ -0,0 +1,131 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import httpx
+
+OLLAMA_URL = "http://localhost:11434"
+
+
+@dataclass
+class ModelLoad:
+    model: str
+    wall_time: float       # tempo lato client per la richiesta di caricamento
+    load_duration: float   # load_duration riportato da Ollama (secondi)
+    already_loaded: bool
+
+
+# Modelli attualmente residenti nel server Ollama
+def loaded_models(base_url: str = OLLAMA_URL) -> set[str]:
+    response = httpx.get(f"{base_url}/api/ps", timeout=10)
+    response.raise_for_status()
+    return {m["name"] for m in response.json().get("models", [])}
+
+
+# Una richiesta /api/generate senza prompt carica soltanto il modello in memoria
+def load_model(model: str, keep_alive: str = "30m", base_url: str = OLLAMA_URL) -> ModelLoad:
+    resident = model in loaded_models(base_url)
+    start = time.perf_counter()
+    response = httpx.post(
+        f"{base_url}/api/generate",
+        json={"model": model, "keep_alive": keep_alive},
+        timeout=None,
+    )
+    response.raise_for_status()
+    wall_time = time.perf_counter() - start
+    load_duration = response.json().get("load_duration", 0) / 1e9
+    return ModelLoad(model, wall_time, load_duration, resident)
+
+
+# Caricamento in parallelo su piu' server: conta il piu' lento. Un server che non
+# risponde viene saltato (il pool di endpoint lo escludera' alla prima chiamata fallita)
+def load_model_all(model: str, keep_alive: str, base_urls: list[str]) -> ModelLoad:
+    if len(base_urls) == 1:
+        return load_model(model, keep_alive, base_urls[0])
+
+    def try_load(url: str) -> ModelLoad | None:
+        try:
+            return load_model(model, keep_alive, url)
+        except httpx.HTTPError as exc:
+            print(f"Load failed on {url}: {exc!r}")
+            return None
+
+    with ThreadPoolExecutor(len(base_urls)) as pool:
+        loads = [load for load in pool.map(try_load, base_urls) if load is not None]
+    if not loads:
+        raise ConnectionError(f"Could not load {model} on any of {base_urls}")
+    return ModelLoad(
+        model,
+        max(load.wall_time for load in loads),
+        max(load.load_duration for load in loads),
+        all(load.already_loaded for load in loads),
+    )
+
+
+def unload_model(model: str, base_url: str = OLLAMA_URL):
+    response = httpx.post(
+        f"{base_url}/api/generate",
+        json={"model": model, "keep_alive": 0},
+        timeout=60,
+    )
+    response.raise_for_status()
+
+
+# Ordina i modelli mettendo per primi quelli gia' residenti: il primo gruppo non paga
+# lo swap e ogni modello viene caricato al massimo una volta per invocazione.
+def schedule_models(models: list[str], base_url: str = OLLAMA_URL) -> list[str]:
+    try:
+        resident = loaded_models(base_url)
+    except httpx.HTTPError:
+        resident = set()
+    unique = list(dict.fromkeys(models))
+    return sorted(unique, key=lambda m: m not in resident)
+
+
+# Esegue l'intera griglia di ciascun modello mentre e' residente, con caricamento
+# esplicito prima del gruppo e scaricamento esplicito subito dopo. Con una lista di
+# base_url (pool di endpoint) il modello viene caricato e scaricato su tutti i server.
+# Un modello che non si carica (es. non ancora scaricato con `ollama pull`) viene
+# segnalato e saltato, senza interrompere i gruppi degli altri modelli.
+def run_model_groups(
+    models: list[str],
+    run_group: Callable[[str, ModelLoad], Any],
+    keep_alive: str = "30m",
+    unload_after: bool = True,
+    base_url: str | list[str] = OLLAMA_URL,
+    needs_run: Callable[[str], bool] | None = None,
+) -> dict[str, Any]:
+    base_urls = [base_url] if isinstance(base_url, str) else list(base_url)
+    results = {}
+    failed = {}
+    for model in schedule_models(models, base_urls[0]):
+        # Niente caricamento per i modelli senza celle da eseguire (es. sweep ripresa)
+        if needs_run is not None and not needs_run(model):
+            print(f"Model skipped, nothing to run: {model}")
+            continue
+        try:
+            load = load_model_all(model, keep_alive, base_urls)
+        except (httpx.HTTPError, ConnectionError) as exc:
+            failed[model] = exc
+            print(f"Model skipped, load failed: {model}: {exc!r}")
+            continue
+        print(
+            f"Model loaded: {model} in {load.wall_time:.1f}s "
+            f"(server load_duration={load.load_duration:.1f}s, resident={load.already_loaded})"
+        )
+        try:
+            results[model] = run_group(model, load)
+        finally:
+            if unload_after:
+                for url in base_urls:
+                    try:
+                        unload_model(model, url)
+                    except httpx.HTTPError as exc:
+                        # Un server caduto durante la sweep non deve interrompere le altre
+                        if len(base_urls) == 1:
+                            raise
+                        print(f"Unload failed on {url}: {exc!r}")
+    if failed:
+        print(f"Models not run because they could not be loaded: {', '.join(failed)}")
+    return results
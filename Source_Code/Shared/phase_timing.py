@@ -0,0 +1,148 @@
+import argparse
+import csv
+import os
+from collections import defaultdict
+
+import mlflow
+from mlflow.tracking import MlflowClient
+
+# Fasi di una generazione: render del prompt lato client, caricamento del modello,
+# lettura del prompt (prompt-eval), generazione dell'output (eval), resto del tempo
+# lato server e trasporto HTTP/serializzazione lato client
+PHASES = ["render", "load", "prompt_eval", "eval", "server_other", "transport"]
+LABELS = {
+    "model_load": "model loading (scheduler)",
+    "render": "prompt rendering",
+    "load": "model loading (in call)",
+    "prompt_eval": "reading the prompt",
+    "eval": "generating output",
+    "server_other": "other server time",
+    "transport": "HTTP / client overhead",
+}
+# Campi di temporizzazione delle risposte native di Ollama (/api/chat), in nanosecondi
+OLLAMA_DURATIONS = ["total_duration", "load_duration", "prompt_eval_duration", "eval_duration"]
+OLLAMA_COUNTS = ["prompt_eval_count", "eval_count"]
+
+
+def server_timing(metadata: dict) -> dict:
+    return {k: metadata[k] for k in OLLAMA_DURATIONS + OLLAMA_COUNTS if metadata.get(k) is not None}
+
+
+# Durata delle fasi (secondi) di una generazione. Con i campi di Ollama le fasi sono quelle
+# misurate dal server; con l'endpoint OpenAI-compatibile (che non li restituisce) si stima
+# prompt_eval (+ load) con il time-to-first-token e eval con il resto della chiamata.
+def phase_times(render: float, http: float, server: dict | None = None, ttft: float | None = None) -> dict:
+    phases = dict.fromkeys(PHASES, 0.0)
+    phases["render"] = render
+    if server and "total_duration" in server:
+        total = server["total_duration"] / 1e9
+        for phase in ("load", "prompt_eval", "eval"):
+            phases[phase] = server.get(f"{phase}_duration", 0) / 1e9
+        phases["server_other"] = max(0.0, total - phases["load"] - phases["prompt_eval"] - phases["eval"])
+        phases["transport"] = max(0.0, http - total)
+        phases["source"] = "server"
+    elif ttft is not None:
+        phases["prompt_eval"] = min(ttft, http)
+        phases["eval"] = max(0.0, http - ttft)
+        phases["source"] = "client_estimate"
+    else:
+        phases["transport"] = http
+        phases["source"] = "client"
+    return phases
+
+
+# Span strutturati di una generazione (inizio relativo e durata in secondi): la chiamata
+# HTTP contiene le fasi lato server nell'ordine in cui Ollama le esegue
+def generation_spans(gen: int, phases: dict, server: dict | None = None) -> list[dict]:
+    render = phases["render"]
+    http = sum(phases[p] for p in PHASES if p != "render")
+    spans = [
+        {"gen": gen, "name": "generation", "parent": None, "start": 0.0, "duration": render + http},
+        {"gen": gen, "name": "render", "parent": "generation", "start": 0.0, "duration": render},
+        {"gen": gen, "name": "http", "parent": "generation", "start": render, "duration": http,
+         "source": phases["source"], **(server or {})},
+    ]
+    start = render
+    for phase in ("load", "prompt_eval", "eval", "server_other"):
+        if phases[phase]:
+            spans.append({"gen": gen, "name": phase, "parent": "http", "start": start, "duration": phases[phase]})
+            start += phases[phase]
+    return spans
+
+
+# Totali per fase di una sweep (o di un modello) e riepilogo testuale
+class PhaseSummary:
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.generations = 0
+
+    def add(self, phases: dict):
+        for phase in PHASES:
+            self.totals[phase] += phases[phase]
+        self.generations += 1
+
+    def add_model_load(self, seconds: float):
+        self.totals["model_load"] += seconds
+
+    def merge(self, other: "PhaseSummary"):
+        for phase, value in other.totals.items():
+            self.totals[phase] += value
+        self.generations += other.generations
+
+    def report(self, title: str = "Time breakdown") -> str:
+        total = sum(self.totals.values())
+        lines = [f"{title}: {total:.1f}s summed over {self.generations} generations"]
+        for phase in ["model_load", *PHASES]:
+            value = self.totals.get(phase, 0.0)
+            if value:
+                share = value / total * 100 if total else 0.0
+                lines.append(f"  {LABELS[phase]:<27} {value:9.2f}s  {share:5.1f}%")
+        return "\n".join(lines)
+
+
+# Riepilogo di un esperimento gia' eseguito a partire dalle metriche <fase>_time_total
+# delle run; il caricamento esplicito del modello e' contato una volta per modello
+def experiment_summary(client: MlflowClient, experiment_name: str) -> dict[str, PhaseSummary]:
+    experiment = client.get_experiment_by_name(experiment_name)
+    summaries = defaultdict(PhaseSummary)
+    loads = {}
+    for run in client.search_runs([experiment.experiment_id], max_results=50000):
+        # Run di servizio (immagini di input, statistiche degli endpoint)
+        if "run_type" in run.data.tags:
+            continue
+        metrics = run.data.metrics
+        model = run.data.params.get("model", "unknown")
+        summary = summaries[model]
+        for phase in PHASES:
+            summary.totals[phase] += metrics.get(f"{phase}_time_total", 0.0)
+        summary.generations += int(metrics.get("timed_generations", 0))
+        loads[model] = max(loads.get(model, 0.0), metrics.get("model_load_time", 0.0))
+    for model, seconds in loads.items():
+        summaries[model].add_model_load(seconds)
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Where the time of a sweep went, per model and phase")
+    parser.add_argument("experiment")
+    parser.add_argument("--tracking-uri", default="http://127.0.0.1:5000")
+    parser.add_argument("--out", default=None, help="optional CSV with the per-model totals")
+    args = parser.parse_args()
+
+    mlflow.set_tracking_uri(args.tracking_uri)
+    summaries = experiment_summary(MlflowClient(), args.experiment)
+    overall = PhaseSummary()
+    for model, summary in sorted(summaries.items()):
+        print(summary.report(f"[{model}]"))
+        overall.merge(summary)
+    print(overall.report(f"[{args.experiment}]"))
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["model", "generations", "model_load", *PHASES])
+            for model, summary in sorted(summaries.items()):
+                writer.writerow([model, summary.generations, summary.totals.get("model_load", 0.0),
+                                 *(summary.totals.get(p, 0.0) for p in PHASES)])
+        print(f"Totals -> {args.out}")
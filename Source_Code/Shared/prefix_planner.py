@@ -0,0 +1,47 @@
+import re
+
+from langchain_core.prompts import PromptTemplate
+
+SECTION_RE = re.compile(r"^\[([^\]\n]+)\]\n", re.M)
+
+
+# Divide un template nelle sezioni "[Nome]\n..." nell'ordine in cui compaiono
+def split_sections(template: str) -> list[tuple[str, str]]:
+    matches = list(SECTION_RE.finditer(template))
+    sections = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(template)
+        sections.append((match.group(1), template[match.start():end].rstrip()))
+    return sections
+
+
+# Riordina le sezioni di tutte le varianti mettendo per prime quelle identiche in tutte
+# (e lo slot delle immagini), poi quelle specifiche della variante: le richieste delle
+# diverse varianti condividono cosi' il prefisso piu' lungo possibile.
+def shared_prefix_templates(templates: dict[str, PromptTemplate]) -> dict[str, PromptTemplate]:
+    sections = {name: split_sections(t.template) for name, t in templates.items()}
+    first = next(iter(sections.values()))
+    shared = [
+        header for header, text in first
+        if "{image}" in text or all(dict(s).get(header) == text for s in sections.values())
+    ]
+    reordered = {}
+    for name, parts in sections.items():
+        static = [text for header, text in parts if header in shared]
+        specific = [text for header, text in parts if header not in shared]
+        template = PromptTemplate.from_template("\n\n".join(static + specific) + "\n")
+        template.input_variables = templates[name].input_variables
+        reordered[name] = template
+    return reordered
+
+
+# Ordina le celle per sfruttare la cache di prompt-evaluation del server: una cella di
+# riscaldamento per variante (eseguite per prime, in parallelo tra loro, ciascuna
+# popola uno slot) e poi le restanti raggruppate per variante, in ordine stabile.
+def plan_cells(cells: list, key=lambda cell: (cell.model, cell.prompt_name)) -> tuple[list, list]:
+    groups = {}
+    for cell in cells:
+        groups.setdefault(key(cell), []).append(cell)
+    warmup = [group[0] for group in groups.values()]
+    rest = [cell for group in groups.values() for cell in group[1:]]
+    return warmup, rest
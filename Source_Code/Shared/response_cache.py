@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Chiave content-addressed di una generazione: cambia se cambia il modello, il prompt
+# renderizzato, i parametri di campionamento, il contenuto (non il nome) delle immagini o
+# le opzioni della chiamata che cambiano l'output (es. limite di token, API).
+# Le immagini restano nell'ordine di invio, perche' l'ordine cambia cio' che vede il modello.
+def generation_key(
+    model: str,
+    rendered_prompt: str,
+    temperature: float,
+    seed: int | None,
+    gen: int,
+    image_hashes: list[str],
+    options: dict | None = None,
+) -> str:
+    payload = json.dumps(
+        {
+            "model": model,
+            "prompt": rendered_prompt,
+            "temperature": round(temperature, 4),
+            "seed": seed,
+            "gen": gen,
+            "images": list(image_hashes),
+            "options": options or {},
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Cache su disco delle risposte: un file JSON per chiave, eviction LRU sulla dimensione
+# totale usando l'mtime come istante di ultimo accesso. La dimensione totale viene
+# calcolata una volta e poi aggiornata a ogni scrittura: la cache viene percorsa di nuovo
+# solo quando supera max_bytes.
+class ResponseCache:
+    def __init__(self, root: str = ".cache/responses", max_bytes: int = 256 * 1024 * 1024, refresh: bool = False):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        self._size = None
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key: str, scope: str = "") -> dict | None:
+        path = self._path(key)
+        if not self.refresh and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                os.utime(path)  # aggiorna l'ordine LRU
+                with self._lock:
+                    self.hits[scope] += 1
+                return entry
+        with self._lock:
+            self.misses[scope] += 1
+        return None
+
+    def put(self, key: str, entry: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({**entry, "cached_at": time.time()}, f, ensure_ascii=False)
+        size = os.path.getsize(tmp)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            try:
+                self._size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp, path)
+            self._size += size
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for fname in filenames:
+                if not fname.endswith(".json"):
+                    continue
+                path = os.path.join(dirpath, fname)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            # Rimuove prima le voci usate meno di recente
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            self._size = total
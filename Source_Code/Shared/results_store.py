@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from mlflow.tracking import MlflowClient
+
+RESULTS_DIR = os.path.join("..", "..", "Results", "tasks_dataset")
+EXPORT_DIR = os.path.join("..", "..", "Results", "exports")
+
+SCHEMA = pa.schema([
+    ("system", pa.string()),
+    ("model", pa.string()),
+    ("model_slug", pa.string()),
+    ("prompt_type", pa.string()),
+    ("temperature", pa.float64()),
+    ("generation", pa.int32()),
+    ("run_id", pa.string()),
+    ("task_index", pa.int32()),
+    ("task", pa.string()),
+    ("reasoning", pa.string()),
+])
+PARTITION_COLS = ["system", "model_slug"]
+
+# Intestazione di sezione ("Reasoning", "**Tasks:**", "## Tasks", ...) su una riga propria
+# o seguita da ":"; il resto della riga appartiene alla sezione
+SECTION_RE = re.compile(r"^[ \t#*_>]*(reasoning|tasks)[ \t*_]*(?::[ \t*_]*|$)(.*)$", re.I | re.M)
+BULLET_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+(.*\S)\s*$")
+OUTPUT_NAME_RE = re.compile(r"output_(.+)_gen_(\d+)\.txt$")
+FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+def _clean(text: str) -> str:
+    return text.strip().strip("*_").strip()
+
+
+# Output strutturato (varianti *_json, vedi structured_output.py), anche racchiuso in
+# ```json ... ```: None se il testo non e' un oggetto JSON con la lista "tasks"
+def parse_structured(text: str) -> tuple[str, list[str]] | None:
+    stripped = FENCE_RE.sub("", text).strip()
+    if not stripped.startswith("{"):
+        return None
+    try:
+        data = json.loads(stripped)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("tasks"), list):
+        return None
+    tasks = [_clean(t) for t in data["tasks"] if isinstance(t, str) and t.strip()]
+    reasoning = data.get("reasoning")
+    return reasoning.strip() if isinstance(reasoning, str) else "", tasks
+
+
+# Divide l'output del modello nelle sezioni "Reasoning" e "Tasks" richieste dallo
+# STRUCTURE dei prompt; i task sono le voci puntate/numerate della sezione Tasks.
+# Gli output JSON vengono letti direttamente, senza estrarre i task dal testo.
+def parse_output(text: str) -> tuple[str, list[str]]:
+    structured = parse_structured(text)
+    if structured is not None:
+        return structured
+    sections = {}
+    matches = list(SECTION_RE.finditer(text))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        name = match.group(1).lower()
+        body = (match.group(2) + "\n" + text[match.end():end]).strip()
+        # Prima occorrenza di ciascuna sezione
+        sections.setdefault(name, body)
+
+    tasks_body = sections.get("tasks")
+    if tasks_body is None:
+        return sections.get("reasoning", text.strip()), []
+    lines = [l for l in tasks_body.splitlines() if l.strip()]
+    bullets = [_clean(m.group(1)) for m in map(BULLET_RE.match, lines) if m]
+    tasks = bullets if bullets else [_clean(l) for l in lines]
+    return sections.get("reasoning", ""), [t for t in tasks if t]
+
+
+def model_slug(model: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "-", model)
+
+
+def task_rows(text: str, system: str, model: str, prompt_type: str,
+              temperature: float, generation: int, run_id: str) -> list[dict]:
+    reasoning, tasks = parse_output(text)
+    return [
+        {
+            "system": system,
+            "model": model,
+            "model_slug": model_slug(model),
+            "prompt_type": prompt_type,
+            "temperature": round(float(temperature), 2),
+            "generation": int(generation),
+            "run_id": run_id,
+            "task_index": i,
+            "task": task,
+            "reasoning": reasoning,
+        }
+        for i, task in enumerate(tasks, start=1)
+    ]
+
+
+# File della generazione `generation` di una run nella partizione (sistema, modello);
+# senza generation, i file di tutte le generazioni della run
+def generation_files(root: str, system: str, model: str, run_id: str, generation: int | None = None) -> list[str]:
+    folder = os.path.join(root, f"system={system}", f"model_slug={model_slug(model)}")
+    prefix = f"{run_id}-gen" if generation is None else f"{run_id}-gen{int(generation)}-"
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, f) for f in os.listdir(folder) if f.startswith(prefix) and f.endswith(".parquet")]
+
+
+# Aggiunge le righe al dataset Parquet partizionato per sistema e modello. Il nome
+# del file e' deterministico (run_id + generazione).
+def append_rows(rows: list[dict], root: str = RESULTS_DIR):
+    if not rows:
+        return
+    table = pa.Table.from_pylist(rows, schema=SCHEMA)
+    first = rows[0]
+    pq.write_to_dataset(
+        table,
+        root_path=root,
+        partition_cols=PARTITION_COLS,
+        basename_template=f"{first['run_id']}-gen{first['generation']}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+# Riscrivere una generazione sostituisce le sue righe: i file precedenti vengono rimossi
+# prima di scrivere, anche quando il nuovo output non contiene task
+def append_output(text: str, root: str = RESULTS_DIR, **run_info) -> int:
+    rows = task_rows(text, **run_info)
+    for path in generation_files(root, run_info["system"], run_info["model"],
+                                 run_info["run_id"], run_info["generation"]):
+        os.remove(path)
+    append_rows(rows, root)
+    return len(rows)
+
+
+def load_tasks(root: str = RESULTS_DIR, filter=None) -> pd.DataFrame:
+    dataset = ds.dataset(root, format="parquet", partitioning="hive")
+    return dataset.to_table(filter=filter).to_pandas()
+
+
+# Popola il dataset dagli artifact output_*_gen_*.txt gia' presenti in un esperimento MLflow
+def ingest_experiment(client: MlflowClient, experiment_name: str, system: str, root: str = RESULTS_DIR) -> int:
+    experiment = client.get_experiment_by_name(experiment_name)
+    total = 0
+    for run in client.search_runs([experiment.experiment_id], max_results=50000):
+        if run.data.tags.get("run_type") == "inputs":
+            continue
+        params = run.data.params
+        for artifact in client.list_artifacts(run.info.run_id):
+            match = OUTPUT_NAME_RE.match(artifact.path)
+            if not match:
+                continue
+            local = client.download_artifacts(run.info.run_id, artifact.path)
+            with open(local, encoding="utf-8") as f:
+                text = f.read()
+            total += append_output(
+                text, root,
+                system=system,
+                model=params.get("model", ""),
+                prompt_type=run.data.tags.get("prompt_type", match.group(1)),
+                temperature=float(params.get("temperature", "nan")),
+                generation=int(match.group(2)),
+                run_id=run.info.run_id,
+            )
+    return total
+
+
+# Rigenera le viste Excel (un file per sistema e modello, un foglio per tipo di prompt)
+def export_excel(root: str = RESULTS_DIR, out_dir: str = EXPORT_DIR) -> list[str]:
+    df = load_tasks(root)
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    columns = ["temperature", "generation", "task_index", "task", "reasoning", "run_id"]
+    for (system, model), group in df.groupby(["system", "model"]):
+        family = re.match(r"[A-Za-z]+", model).group(0).lower() if model else "unknown"
+        path = os.path.join(out_dir, f"final_tasks_generated_{system.lower()}_{family}.xlsx")
+        with pd.ExcelWriter(path) as writer:
+            for prompt_type, rows in group.groupby("prompt_type"):
+                rows.sort_values(["temperature", "generation", "task_index"])[columns].to_excel(
+                    writer, sheet_name=prompt_type, index=False
+                )
+        written.append(path)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generated tasks dataset (Parquet) and Excel export")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="parse the outputs of an MLflow experiment into the dataset")
+    ingest.add_argument("--experiment", required=True)
+    ingest.add_argument("--system", required=True)
+    ingest.add_argument("--tracking-uri", default="http://127.0.0.1:5000")
+    export = sub.add_parser("export", help="regenerate the Excel views from the dataset")
+    export.add_argument("--out", default=EXPORT_DIR)
+    parser.add_argument("--root", default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        n = ingest_experiment(MlflowClient(args.tracking_uri), args.experiment, args.system, args.root)
+        print(f"Ingested {n} tasks into {args.root}")
+    else:
+        for path in export_excel(args.root, args.out):
+            print(f"Written {path}")
@@ -0,0 +1,333 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from html_outline import load_html_paths, parse_page
+from results_store import EXPORT_DIR, RESULTS_DIR
+
+ANALYSIS_VERSION = 1
+CACHE_DIR = os.path.join(".cache", "analysis")
+PROTOTYPES_DIR = os.path.join("..", "..", "Prototypes")
+USER_STUDY_PATH = os.path.join("..", "..", "Results", "User_study_results.xlsx")
+# Corrispondenza tra i task del questionario e quelli del dataset (study_task, system, model,
+# prompt_type, temperature, generation, task_index): il file del questionario non contiene i testi
+STUDY_TASKS_PATH = os.path.join("..", "..", "Results", "user_study_tasks.csv")
+CRITERIA = ["Functionality-oriented", "Utility", "Precision", "Completeness"]
+
+# File del dataset scritti da results_store.append_rows: <run_id>-gen<n>-<i>.parquet
+FILE_RE = re.compile(r"(.+)-gen(\d+)-\d+\.parquet$")
+# Termini di interfaccia generici: un task atomico descrive l'obiettivo, non i widget
+UI_TERMS_RE = re.compile(
+    r"\b(click|tap|button|icon|drop-?down|checkbox|menu|tab|scroll|text ?box|text field|sidebar|navbar|pop-?up)s?\b",
+    re.I,
+)
+# Piu' azioni in sequenza nello stesso task
+MULTI_STEP_RE = re.compile(r"\b(and then|then|after that|afterwards|finally|once done)\b|;", re.I)
+QUOTED_RE = re.compile(r"[\"“'‘]([^\"”'’]{2,60})[\"”'’]")
+FEATURES = ["task_count", "mean_task_words", "max_task_words", "reasoning_words",
+            "label_leak_tasks", "ui_term_tasks", "multi_step_tasks"]
+
+
+# Etichette visibili del prototipo (titoli, pulsanti, campi, navigazione, tabelle), senza
+# numeri, date e frammenti; la chiave di versione cambia se cambia l'HTML
+def ui_vocabulary(system: str, prototypes_dir: str = PROTOTYPES_DIR) -> tuple[set[str], str]:
+    folder = os.path.join(prototypes_dir, system.lower(), "html")
+    labels = set()
+    paths = load_html_paths(folder) if os.path.isdir(folder) else []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            items = parse_page(f.read())
+        for category in ("headings", "buttons", "inputs", "navigation", "tables"):
+            for label in items[category]:
+                label = label.strip().lower()
+                if len(label.split()) <= 5 and not re.search(r"\d", label) and re.search(r"[a-z]{4}", label):
+                    labels.add(label)
+    digest = hashlib.sha256(json.dumps(sorted(labels)).encode("utf-8")).hexdigest()[:16]
+    return labels, digest
+
+
+# Un task "riporta" un'etichetta del prototipo se contiene un'etichetta di piu' parole
+# o se cita tra virgolette un'etichetta qualsiasi (es. click on "Add Patient")
+def leaks_label(task: str, labels: set[str]) -> bool:
+    text = task.lower()
+    quoted = {q.strip().lower() for q in QUOTED_RE.findall(task)}
+    if quoted & labels:
+        return True
+    return any(" " in label and re.search(rf"\b{re.escape(label)}\b", text) for label in labels)
+
+
+def words(text: str) -> int:
+    return len(text.split())
+
+
+# Feature di una generazione (tutte le righe di un file del dataset) e dei suoi task
+def run_features(rows: pd.DataFrame, labels: set[str]) -> dict:
+    rows = rows.sort_values("task_index")
+    tasks = []
+    for row in rows.itertuples():
+        tasks.append({
+            "task_index": int(row.task_index),
+            "words": words(row.task),
+            "label_leak": leaks_label(row.task, labels),
+            "ui_term": bool(UI_TERMS_RE.search(row.task)),
+            "multi_step": bool(MULTI_STEP_RE.search(row.task)),
+        })
+    first = rows.iloc[0]
+    lengths = [t["words"] for t in tasks]
+    return {
+        "model": first["model"],
+        "prompt_type": first["prompt_type"],
+        "temperature": float(first["temperature"]),
+        "generation": int(first["generation"]),
+        "run_id": first["run_id"],
+        "task_count": len(tasks),
+        "mean_task_words": sum(lengths) / len(lengths),
+        "max_task_words": max(lengths),
+        "reasoning_words": words(first["reasoning"] or ""),
+        "label_leak_tasks": sum(t["label_leak"] for t in tasks),
+        "ui_term_tasks": sum(t["ui_term"] for t in tasks),
+        "multi_step_tasks": sum(t["multi_step"] for t in tasks),
+        "tasks": tasks,
+    }
+
+
+# Generazioni presenti nel dataset, senza leggerlo: chiave "<system>|<run_id>|<gen>",
+# file che la compongono e impronta (dimensione e mtime) per accorgersi delle riscritture
+def scan_dataset(root: str = RESULTS_DIR) -> dict[str, dict]:
+    found = {}
+    for dirpath, _, filenames in os.walk(root):
+        parts = dict(p.split("=", 1) for p in os.path.relpath(dirpath, root).split(os.sep) if "=" in p)
+        if "system" not in parts:
+            continue
+        for fname in sorted(filenames):
+            match = FILE_RE.match(fname)
+            if not match:
+                continue
+            path = os.path.join(dirpath, fname)
+            key = f"{parts['system']}|{match.group(1)}|{match.group(2)}"
+            stat = os.stat(path)
+            entry = found.setdefault(key, {"system": parts["system"], "paths": [], "stamp": ""})
+            entry["paths"].append(path)
+            entry["stamp"] += f"{fname}:{stat.st_size}:{stat.st_mtime_ns};"
+    return found
+
+
+# Feature memorizzate per generazione in un JSONL append-only: vale l'ultimo record di
+# ogni chiave, ricalcolato solo se cambiano file, vocabolario del prototipo o versione
+class FeatureStore:
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.path = os.path.join(cache_dir, "run_features.jsonl")
+        self.records = {}
+        self.by_fingerprint = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.records[record["key"]] = record
+                    self.by_fingerprint[record["fingerprint"]] = record
+
+    @staticmethod
+    def fingerprint(stamp: str, vocab: str) -> str:
+        return f"v{ANALYSIS_VERSION}:{vocab}:{stamp}"
+
+    def get(self, key: str, fingerprint: str) -> dict | None:
+        record = self.records.get(key)
+        return record if record and record["fingerprint"] == fingerprint else None
+
+    def put(self, record: dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.records[record["key"]] = record
+        self.by_fingerprint[record["fingerprint"]] = record
+
+
+# Somme per gruppo (sistema, modello, prompt, temperatura) aggiornate in modo incrementale:
+# per ogni generazione si aggiungono (o tolgono, se riscritta o rimossa) n, somma e somma
+# dei quadrati di ogni feature. Il contributo da togliere e' il record con l'impronta
+# registrata negli aggregati, non necessariamente l'ultimo della FeatureStore.
+class Aggregates:
+    GROUP = ["system", "model", "prompt_type", "temperature"]
+
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.path = os.path.join(cache_dir, "aggregates.json")
+        self.included = {}
+        self.groups = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("version") == ANALYSIS_VERSION:
+                self.included = state["included"]
+                self.groups = state["groups"]
+
+    def reset(self):
+        self.included = {}
+        self.groups = {}
+
+    def _apply(self, record: dict, sign: int):
+        group = "|".join(str(record[k]) for k in self.GROUP)
+        sums = self.groups.setdefault(group, {f: [0, 0.0, 0.0] for f in FEATURES})
+        for feature in FEATURES:
+            value = record[feature]
+            sums[feature][0] += sign
+            sums[feature][1] += sign * value
+            sums[feature][2] += sign * value * value
+        if sums["task_count"][0] == 0:
+            del self.groups[group]
+
+    def update(self, record: dict, store: FeatureStore) -> bool:
+        included = self.included.get(record["key"])
+        if included == record["fingerprint"]:
+            return False
+        if included is not None:
+            self._apply(store.by_fingerprint[included], -1)
+        self._apply(record, +1)
+        self.included[record["key"]] = record["fingerprint"]
+        return True
+
+    def remove(self, key: str, store: FeatureStore):
+        self._apply(store.by_fingerprint[self.included.pop(key)], -1)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": ANALYSIS_VERSION, "included": self.included, "groups": self.groups}, f)
+        os.replace(tmp, self.path)
+
+    def table(self) -> pd.DataFrame:
+        rows = []
+        for group, sums in self.groups.items():
+            row = dict(zip(self.GROUP, group.split("|")))
+            row["temperature"] = float(row["temperature"])
+            row["generations"] = sums["task_count"][0]
+            for feature, (n, total, squares) in sums.items():
+                mean = total / n
+                row[f"{feature}_mean"] = mean
+                # Deviazione standard campionaria, come STDEV nei fogli di analisi
+                row[f"{feature}_std"] = math.sqrt(max(0.0, (squares - n * mean * mean) / (n - 1))) if n > 1 else 0.0
+            rows.append(row)
+        return pd.DataFrame(rows).sort_values(self.GROUP) if rows else pd.DataFrame(rows)
+
+
+# Calcola le feature solo delle generazioni nuove o riscritte e aggiorna gli aggregati;
+# restituisce il numero di generazioni (ri)calcolate e di quelle rimosse
+def update(root: str = RESULTS_DIR, cache_dir: str = CACHE_DIR,
+           prototypes_dir: str = PROTOTYPES_DIR) -> tuple[FeatureStore, Aggregates, int, int]:
+    store = FeatureStore(cache_dir)
+    aggregates = Aggregates(cache_dir)
+    # Aggregati non coerenti con le feature memorizzate (cache cancellata): si ripartono da zero
+    if any(fp not in store.by_fingerprint for fp in aggregates.included.values()):
+        aggregates.reset()
+    vocabularies = {}
+    found = scan_dataset(root)
+    computed = 0
+    for key, entry in sorted(found.items()):
+        system = entry["system"]
+        if system not in vocabularies:
+            vocabularies[system] = ui_vocabulary(system, prototypes_dir)
+        labels, vocab = vocabularies[system]
+        fingerprint = FeatureStore.fingerprint(entry["stamp"], vocab)
+        record = store.get(key, fingerprint)
+        if record is None:
+            rows = pd.concat([pq.read_table(p).to_pandas() for p in entry["paths"]], ignore_index=True)
+            if rows.empty:
+                continue
+            record = {"key": key, "fingerprint": fingerprint, "system": system, **run_features(rows, labels)}
+            store.put(record)
+            computed += 1
+        aggregates.update(record, store)
+    removed = [k for k in aggregates.included if k not in found]
+    for key in removed:
+        aggregates.remove(key, store)
+    aggregates.save()
+    return store, aggregates, computed, len(removed)
+
+
+def features_table(store: FeatureStore, keys=None) -> pd.DataFrame:
+    records = [r for k, r in store.records.items() if keys is None or k in keys]
+    columns = ["system", "model", "prompt_type", "temperature", "generation", "run_id", *FEATURES]
+    return pd.DataFrame([{c: r[c] for c in columns} for r in records], columns=columns)
+
+
+# Valutazioni del questionario in formato lungo: colonne "<Criterio><n>" (n vuoto = task 1)
+def load_user_study(path: str = USER_STUDY_PATH) -> pd.DataFrame:
+    raw = pd.read_excel(path)
+    pattern = re.compile(rf"^({'|'.join(map(re.escape, CRITERIA))})(\d*)$")
+    rows = []
+    for column in raw.columns:
+        match = pattern.match(str(column))
+        if not match:
+            continue
+        for participant, score in zip(raw["ID"], raw[column]):
+            if pd.notna(score):
+                rows.append({"participant": participant, "study_task": int(match.group(2) or 1),
+                             "criterion": match.group(1), "score": float(score)})
+    return pd.DataFrame(rows)
+
+
+# Media delle valutazioni per task del questionario affiancata alle feature automatiche
+# del task corrispondente; correlazioni di Spearman tra feature e criteri
+def user_study_comparison(store: FeatureStore, study_path: str = USER_STUDY_PATH,
+                          mapping_path: str = STUDY_TASKS_PATH) -> tuple[pd.DataFrame, pd.DataFrame | None]:
+    ratings = load_user_study(study_path)
+    human = ratings.pivot_table(index="study_task", columns="criterion", values="score", aggfunc="mean")
+    human = human[[c for c in CRITERIA if c in human.columns]].reset_index()
+    if not os.path.exists(mapping_path):
+        return human, None
+
+    mapping = pd.read_csv(mapping_path)
+    tasks = []
+    for record in store.records.values():
+        for task in record["tasks"]:
+            tasks.append({"system": record["system"], "model": record["model"],
+                          "prompt_type": record["prompt_type"], "temperature": round(record["temperature"], 2),
+                          "generation": record["generation"], **task})
+    keys = ["system", "model", "prompt_type", "temperature", "generation", "task_index"]
+    mapping["temperature"] = mapping["temperature"].round(2)
+    merged = mapping.merge(pd.DataFrame(tasks, columns=keys + ["words", "label_leak", "ui_term", "multi_step"]),
+                           on=keys, how="left").merge(human, on="study_task", how="left")
+    features = ["words", "label_leak", "ui_term", "multi_step"]
+    criteria = [c for c in CRITERIA if c in merged.columns]
+    matched = merged.dropna(subset=["words"])
+    corr = matched[features + criteria].astype(float).corr(method="spearman").loc[features, criteria]
+    return merged, corr.reset_index().rename(columns={"index": "feature"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental per-run analysis of the generated tasks")
+    parser.add_argument("--root", default=RESULTS_DIR)
+    parser.add_argument("--out", default=EXPORT_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--user-study", default=USER_STUDY_PATH)
+    parser.add_argument("--study-tasks", default=STUDY_TASKS_PATH)
+    args = parser.parse_args()
+
+    store, aggregates, computed, removed = update(args.root, args.cache_dir)
+    print(f"Runs: {len(aggregates.included)} in dataset, {computed} analysed now, {removed} removed")
+
+    os.makedirs(args.out, exist_ok=True)
+    reports = {
+        "run_features": features_table(store, aggregates.included),
+        "aggregates": aggregates.table(),
+    }
+    if os.path.exists(args.user_study):
+        comparison, correlation = user_study_comparison(store, args.user_study, args.study_tasks)
+        reports["user_study_comparison"] = comparison
+        if correlation is None:
+            print(f"No {args.study_tasks}: user study ratings exported without the task features")
+        else:
+            reports["user_study_correlation"] = correlation
+    for name, report in reports.items():
+        path = os.path.join(args.out, f"analysis_{name}.csv")
+        report.to_csv(path, index=False)
+        print(f"{name}: {len(report)} rows -> {path}")
@@ -0,0 +1,90 @@
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+
+@dataclass
+class StreamResult:
+    text: str
+    latency: float
+    ttft: float
+    prompt_tokens: int
+    completion_tokens: int
+    # response_metadata dei chunk (con l'API nativa di Ollama include le durate delle fasi)
+    metadata: dict = field(default_factory=dict)
+
+    # Token al secondo nella sola fase di decodifica (dopo il primo token)
+    @property
+    def decode_tps(self) -> float:
+        decode_time = self.latency - self.ttft
+        return self.completion_tokens / decode_time if decode_time > 0 else 0.0
+
+    def as_entry(self) -> dict:
+        return {
+            "text": self.text,
+            "latency": self.latency,
+            "ttft": self.ttft,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+
+# Consuma la chain in streaming: misura il time-to-first-token, scrive l'output su
+# `sink_path` man mano che arriva e legge il conteggio dei token dall'usage finale
+# (ChatOpenAI con stream_usage=True). Se il server non restituisce l'usage, i token
+# generati vengono approssimati con il numero di chunk ricevuti. `validator.feed` riceve
+# ogni pezzo di testo e puo' interrompere lo streaming sollevando un'eccezione.
+async def stream_generation(chain: Any, inputs: Any, sink_path: str | None = None,
+                            validator: Any = None) -> StreamResult:
+    parts = []
+    chunks = 0
+    ttft = None
+    usage = None
+    metadata = {}
+    sink = None
+    if sink_path is not None:
+        os.makedirs(os.path.dirname(sink_path) or ".", exist_ok=True)
+        sink = open(sink_path, "w", encoding="utf-8")
+    start = time.perf_counter()
+    try:
+        async for chunk in chain.astream(inputs):
+            text = chunk.text() if callable(getattr(chunk, "text", None)) else str(chunk.content)
+            if text:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                chunks += 1
+                parts.append(text)
+                if sink is not None:
+                    sink.write(text)
+                    sink.flush()
+                if validator is not None:
+                    validator.feed(text)
+            if getattr(chunk, "usage_metadata", None):
+                usage = chunk.usage_metadata
+            if getattr(chunk, "response_metadata", None):
+                metadata.update(chunk.response_metadata)
+    finally:
+        if sink is not None:
+            sink.close()
+    latency = time.perf_counter() - start
+
+    return StreamResult(
+        text="".join(parts),
+        latency=latency,
+        ttft=ttft if ttft is not None else latency,
+        prompt_tokens=usage["input_tokens"] if usage else 0,
+        completion_tokens=usage["output_tokens"] if usage else chunks,
+        metadata=metadata,
+    )
+
+
+# Percentile con interpolazione lineare (come numpy.percentile di default)
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
@@ -0,0 +1,155 @@
+import json
+
+from langchain_core.prompts import PromptTemplate
+
+from prefix_planner import split_sections
+from results_store import parse_structured
+
+SCHEMA_NAME = "usability_tasks"
+
+
+class StructuredOutputError(ValueError):
+    pass
+
+
+# Oggetto JSON interrotto dal limite di token generati: con lo stesso limite un nuovo
+# tentativo verrebbe troncato di nuovo
+class TruncatedOutputError(StructuredOutputError):
+    pass
+
+
+# Schema dell'output strutturato: la lista dei task e, se reasoning_chars > 0, un reasoning
+# di lunghezza limitata. Entrambi i campi sono obbligatori perche' il server genera prima
+# le proprieta' obbligatorie: cosi' il reasoning precede sempre i task.
+def tasks_schema(reasoning_chars: int = 600) -> dict:
+    properties = {}
+    if reasoning_chars:
+        properties["reasoning"] = {"type": "string", "maxLength": reasoning_chars}
+    properties["tasks"] = {"type": "array", "items": {"type": "string", "minLength": 1}, "minItems": 1}
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+# response_format per l'endpoint OpenAI-compatibile (con l'API nativa lo schema va in `format`)
+def json_format(schema: dict) -> dict:
+    return {"type": "json_schema", "json_schema": {"name": SCHEMA_NAME, "schema": schema, "strict": True}}
+
+
+def structure_text(reasoning_chars: int = 600) -> str:
+    if reasoning_chars:
+        fields = (f'"reasoning", a summary of at most {reasoning_chars} characters of the reasoning process '
+                  f'that took you to generate the tasks, and "tasks", the list of tasks with one string per task')
+    else:
+        fields = '"tasks", the list of tasks with one string per task'
+    return f"""
+    The output must be a single JSON object with the fields {fields}. Do not write anything outside the JSON object.
+"""
+
+
+# Stesso prompt con la sezione [Structure] che chiede l'oggetto JSON al posto delle
+# sezioni "Reasoning" e "Tasks"; il resto del testo resta identico
+def structured_prompt(text: str, reasoning_chars: int = 600) -> str:
+    replacement = "[Structure]\n" + structure_text(reasoning_chars)
+    for header, section in split_sections(text):
+        if header == "Structure":
+            return text.replace(section, replacement.rstrip(), 1)
+    return text.rstrip() + "\n\n" + replacement + "\n"
+
+
+def structured_template(template: PromptTemplate, reasoning_chars: int = 600) -> PromptTemplate:
+    structured = PromptTemplate.from_template(structured_prompt(template.template, reasoning_chars))
+    structured.input_variables = template.input_variables
+    return structured
+
+
+# Validazione incrementale dell'output mentre arriva: controlla che sia un unico oggetto
+# JSON con i soli campi dello schema e raccoglie i task man mano che le stringhe si
+# chiudono. Un output non conforme interrompe lo streaming invece di essere decodificato
+# fino in fondo.
+class TaskStream:
+    def __init__(self, reasoning_chars: int = 600):
+        self.reasoning_chars = reasoning_chars
+        self.fields = set(tasks_schema(reasoning_chars)["properties"])
+        self.text = ""
+        self.tasks = []
+        self.started = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.expect_key = False
+        self.key = None
+
+    def feed(self, chunk: str):
+        offset = len(self.text)
+        self.text += chunk
+        for i, ch in enumerate(chunk, start=offset):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    self._string(json.loads(self.text[self.string_start:i + 1]))
+                elif self.key == "reasoning" and self.depth == 1 and not self.expect_key \
+                        and i - self.string_start > 2 * self.reasoning_chars:
+                    # Margine per i caratteri di escape: lo schema limita gia' il server
+                    raise StructuredOutputError(f"reasoning longer than {self.reasoning_chars} characters")
+                continue
+            if ch.isspace():
+                continue
+            if self.done:
+                raise StructuredOutputError("text after the JSON object")
+            if not self.started:
+                if ch != "{":
+                    raise StructuredOutputError("output does not start with a JSON object")
+                self.started = True
+                self.depth = 1
+                self.expect_key = True
+            elif ch == '"':
+                self.in_string = True
+                self.string_start = i
+            elif ch in "{[":
+                self.depth += 1
+                if self.depth > 2 or (self.key == "tasks" and ch == "{"):
+                    raise StructuredOutputError("tasks must be a list of strings")
+            elif ch in "}]":
+                self.depth -= 1
+                self.done = self.depth == 0
+            elif ch == ":" and self.depth == 1:
+                self.expect_key = False
+            elif ch == "," and self.depth == 1:
+                self.expect_key = True
+
+    def _string(self, value: str):
+        if self.depth == 1 and self.expect_key:
+            if value not in self.fields:
+                raise StructuredOutputError(f"unexpected field {value!r}")
+            self.key = value
+        elif self.depth == 2 and self.key == "tasks":
+            if not value.strip():
+                raise StructuredOutputError("empty task")
+            self.tasks.append(value)
+
+    # Controllo finale sull'oggetto completo; restituisce (reasoning, task)
+    def finish(self) -> tuple[str, list[str]]:
+        if not self.done:
+            raise StructuredOutputError("incomplete JSON object")
+        return validate_structured(self.text, self.reasoning_chars)
+
+
+def validate_structured(text: str, reasoning_chars: int = 600) -> tuple[str, list[str]]:
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as exc:
+        raise StructuredOutputError(f"invalid JSON: {exc}") from exc
+    parsed = parse_structured(text)
+    if parsed is None or not parsed[1]:
+        raise StructuredOutputError("missing or empty tasks list")
+    extra = set(data) - set(tasks_schema(reasoning_chars)["properties"])
+    if extra:
+        raise StructuredOutputError(f"unexpected fields {sorted(extra)}")
+    if reasoning_chars and len(parsed[0]) > reasoning_chars:
+        raise StructuredOutputError(f"reasoning longer than {reasoning_chars} characters")
+    return parsed
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+
+# Una cella della griglia: una singola generazione (prompt x temperatura x gen)
+# collegata alla run MLflow a cui vanno attribuiti output e latenza. `prompt` e' il
+# template che produce i messaggi; il modello viene scelto al momento della chiamata.
+@dataclass
+class GridCell:
+    run_id: str
+    run_name: str
+    model: str
+    prompt_name: str
+    temperature: float
+    gen: int
+    prompt: Any
+    input_mode: str = "images"
+
+
+@dataclass
+class SweepReport:
+    wall_time: float = 0.0
+    latencies: dict = field(default_factory=dict)
+    failures: dict = field(default_factory=dict)
+    # Tempo di servizio di ogni chiamata misurato dal server, senza le attese in coda
+    service_times: dict = field(default_factory=dict)
+
+    # Stima del tempo che la stessa griglia avrebbe richiesto chiamata dopo chiamata: la somma
+    # dei tempi di servizio. Le latenze misurate con piu' chiamate in volo includono l'attesa
+    # nella coda del server e non possono farne le veci: senza un tempo di servizio per ogni
+    # generazione la stima non e' disponibile (None).
+    @property
+    def serial_time(self) -> float | None:
+        if not self.latencies or len(self.service_times) < len(self.latencies):
+            return None
+        return sum(self.service_times.values())
+
+    @property
+    def speedup(self) -> float | None:
+        serial = self.serial_time
+        return serial / self.wall_time if serial is not None and self.wall_time else None
+
+    def summary(self) -> str:
+        text = (
+            f"Sweep completed: {len(self.latencies)} generations, "
+            f"{len(self.failures)} failed, wall={self.wall_time:.1f}s"
+        )
+        if self.speedup is None:
+            return text
+        return text + f", serial estimate={self.serial_time:.1f}s, estimated speedup={self.speedup:.2f}x"
+
+
+# Esegue tutte le celle con al massimo `max_concurrency` chiamate in volo (i duplicati
+# dell'hedging di tail_control.py non sono contati).
+# `worker` produce l'output della cella; `on_result` riceve (cella, output, latenza)
+# e `on_run_done` (run_id, fallita) quando tutte le generazioni di una run sono concluse.
+# Le prime `warmup` celle vengono completate prima di avviare le altre. `service_time`
+# estrae dall'output il tempo di servizio della chiamata (None se non disponibile).
+async def run_grid(
+    cells: list[GridCell],
+    worker: Callable[[GridCell], Awaitable[Any]],
+    max_concurrency: int = 4,
+    on_result: Callable[[GridCell, Any, float], None] | None = None,
+    on_run_done: Callable[[str, bool], None] | None = None,
+    warmup: int = 0,
+    service_time: Callable[[Any], float | None] | None = None,
+) -> SweepReport:
+    report = SweepReport()
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    pending = {}
+    for cell in cells:
+        pending[cell.run_id] = pending.get(cell.run_id, 0) + 1
+    failed_runs = set()
+
+    async def guarded(cell: GridCell):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                output = await worker(cell)
+            except Exception as exc:
+                report.failures[(cell.run_id, cell.gen)] = exc
+                failed_runs.add(cell.run_id)
+                print(f"Generation failed: run={cell.run_name}, gen={cell.gen}: {exc!r}")
+            else:
+                latency = time.perf_counter() - start
+                report.latencies[(cell.run_id, cell.gen)] = latency
+                served = service_time(output) if service_time is not None else None
+                if served is not None:
+                    report.service_times[(cell.run_id, cell.gen)] = served
+                if on_result is not None:
+                    # Il logging e' I/O sincrono: lo spostiamo fuori dall'event loop
+                    await asyncio.to_thread(on_result, cell, output, latency)
+
+        pending[cell.run_id] -= 1
+        if pending[cell.run_id] == 0 and on_run_done is not None:
+            await asyncio.to_thread(on_run_done, cell.run_id, cell.run_id in failed_runs)
+
+    start = time.perf_counter()
+    if warmup:
+        await asyncio.gather(*(guarded(cell) for cell in cells[:warmup]))
+    await asyncio.gather(*(guarded(cell) for cell in cells[warmup:]))
+    report.wall_time = time.perf_counter() - start
+    return report
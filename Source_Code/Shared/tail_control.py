@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Hashable
+
+from endpoint_pool import is_endpoint_error
+from streaming import percentile
+
+
+class CallTimeout(Exception):
+    pass
+
+
+# Politica per la coda delle latenze di una sweep:
+#   - ogni tentativo ha una scadenza (timeout, None = nessuna);
+#   - un tentativo fallito per timeout o per un errore `retryable` viene ripetuto fino a
+#     max_retries volte, attendendo backoff * 2^n secondi;
+#   - con hedge=True, se un tentativo supera il percentile `hedge_quantile` delle latenze
+#     gia' osservate per la stessa chiave ne parte un duplicato: vince la prima risposta
+#     valida e l'altra chiamata viene annullata. La latenza registrata per il percentile e'
+#     quella dell'intera chiamata, dalla partenza del tentativo principale: con la sola
+#     latenza del duplicato vincente il percentile scenderebbe a ogni hedge, facendo
+#     partire sempre piu' duplicati.
+# I duplicati non occupano uno slot di max_concurrency di run_grid: con l'hedging attivo
+# le richieste in volo possono arrivare al doppio di max_concurrency.
+# CallTimeout non e' un TimeoutError: una generazione troppo lunga non e' un guasto
+# dell'endpoint e non deve far scattare il failover del pool.
+class TailPolicy:
+    def __init__(self, timeout: float | None = 600.0, max_retries: int = 2, backoff: float = 2.0,
+                 hedge: bool = False, hedge_quantile: float = 95, hedge_min_samples: int = 5,
+                 retryable: Callable[[BaseException], bool] | None = None, window: int = 200):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.retryable = retryable or is_endpoint_error
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+
+    # Ritardo dopo cui duplicare una chiamata con questa chiave (None = niente hedging)
+    def hedge_delay(self, key: Hashable) -> float | None:
+        samples = self.latencies[key]
+        if not self.hedge or len(samples) < self.hedge_min_samples:
+            return None
+        return percentile(list(samples), self.hedge_quantile)
+
+    async def _attempt(self, call: Callable[[str], Awaitable[Any]], label: str) -> Any:
+        try:
+            return await asyncio.wait_for(call(label), self.timeout)
+        except asyncio.TimeoutError:
+            raise CallTimeout(f"no answer within {self.timeout:g}s") from None
+
+    async def _hedged(self, key: Hashable, call: Callable[[str], Awaitable[Any]],
+                      on_event: Callable[[str], None]) -> Any:
+        start = time.perf_counter()
+        result = await self._first_answer(key, call, on_event)
+        self.latencies[key].append(time.perf_counter() - start)
+        return result
+
+    async def _first_answer(self, key: Hashable, call: Callable[[str], Awaitable[Any]],
+                            on_event: Callable[[str], None]) -> Any:
+        primary = asyncio.ensure_future(self._attempt(call, "primary"))
+        delay = self.hedge_delay(key)
+        if delay is None:
+            return await primary
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                on_event("hedged_requests")
+                backup = asyncio.ensure_future(self._attempt(call, "hedge"))
+                pending.add(backup)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            on_event("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # Esegue `call(label)` ("primary" o "hedge") secondo la politica. `on_event` riceve
+    # "timeouts", "retries", "hedged_requests" e "hedge_wins" man mano che accadono.
+    async def run(self, key: Hashable, call: Callable[[str], Awaitable[Any]],
+                  on_event: Callable[[str], None] = lambda event: None) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._hedged(key, call, on_event)
+            except Exception as exc:
+                timed_out = isinstance(exc, CallTimeout)
+                if timed_out:
+                    on_event("timeouts")
+                if attempt == self.max_retries or not (timed_out or self.retryable(exc)):
+                    raise
+                on_event("retries")
+                delay = self.backoff * 2 ** attempt
+                print(f"Retry {attempt + 1}/{self.max_retries} in {delay:.1f}s after {exc!r}")
+                await asyncio.sleep(delay)
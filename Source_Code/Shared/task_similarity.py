@@ -0,0 +1,157 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from openai import OpenAI as RawOpenAI
+
+from results_store import EXPORT_DIR, RESULTS_DIR, load_tasks, model_slug
+
+EMBED_MODEL = "nomic-embed-text"
+
+
+def text_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+# Cache dei vettori su disco: per ogni modello di embedding una matrice float32
+# (vectors.npy) e l'elenco delle chiavi hash del testo nello stesso ordine (keys.json).
+class EmbeddingCache:
+    def __init__(self, model: str, root: str = ".cache/embeddings"):
+        self.model = model
+        self.dir = os.path.join(root, model_slug(model))
+        self.index = {}
+        self.vectors = []
+        keys_path = os.path.join(self.dir, "keys.json")
+        if os.path.exists(keys_path):
+            with open(keys_path, encoding="utf-8") as f:
+                keys = json.load(f)
+            matrix = np.load(os.path.join(self.dir, "vectors.npy"))
+            self.vectors = list(matrix[: len(keys)])
+            self.index = {k: i for i, k in enumerate(keys)}
+
+    def get(self, key: str):
+        i = self.index.get(key)
+        return None if i is None else self.vectors[i]
+
+    def put(self, key: str, vector):
+        self.index[key] = len(self.vectors)
+        self.vectors.append(np.asarray(vector, dtype=np.float32))
+
+    def save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        keys = sorted(self.index, key=self.index.get)
+        np.save(os.path.join(self.dir, "vectors.npy"), np.stack(self.vectors))
+        with open(os.path.join(self.dir, "keys.json"), "w", encoding="utf-8") as f:
+            json.dump(keys, f)
+
+
+# Embedding di tutti i testi: quelli gia' in cache non vengono ricalcolati, gli altri
+# vengono inviati all'endpoint /v1/embeddings di Ollama in batch da `batch_size`.
+def embed_texts(texts: list[str], client: RawOpenAI, model: str = EMBED_MODEL,
+                batch_size: int = 64, cache: EmbeddingCache | None = None) -> np.ndarray:
+    cache = cache or EmbeddingCache(model)
+    keys = [text_key(model, t) for t in texts]
+    todo = list({k: t for k, t in zip(keys, texts) if cache.get(k) is None}.items())
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+        response = client.embeddings.create(model=model, input=[t for _, t in batch])
+        for (key, _), item in zip(batch, response.data):
+            cache.put(key, item.embedding)
+    if todo:
+        cache.save()
+    return np.stack([cache.get(k) for k in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+
+
+def cosine_matrix(a: np.ndarray, b: np.ndarray | None = None) -> np.ndarray:
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    if b is None:
+        return a @ a.T
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    return a @ b.T
+
+
+# Coppie di task quasi identici (stesso sistema) con similarita' >= threshold
+def near_duplicates(df: pd.DataFrame, vectors: np.ndarray, threshold: float) -> pd.DataFrame:
+    rows = []
+    for system, group in df.groupby("system"):
+        idx = group.index.to_numpy()
+        sims = cosine_matrix(vectors[idx])
+        for i, j in zip(*np.nonzero(np.triu(sims >= threshold, k=1))):
+            a, b = idx[i], idx[j]
+            rows.append({
+                "system": system,
+                "task_a": df.at[a, "task"], "source_a": _source(df.loc[a]),
+                "task_b": df.at[b, "task"], "source_b": _source(df.loc[b]),
+                "similarity": float(sims[i, j]),
+            })
+    return pd.DataFrame(rows).sort_values("similarity", ascending=False) if rows else pd.DataFrame(rows)
+
+
+def _source(row) -> str:
+    return f"{row['model']}|{row['prompt_type']}|t={row['temperature']:.1f}|gen={row['generation']}"
+
+
+# Diversita' per temperatura: 1 - similarita' media tra coppie di task distinte
+def temperature_diversity(df: pd.DataFrame, vectors: np.ndarray) -> pd.DataFrame:
+    rows = []
+    keys = ["system", "model", "prompt_type", "temperature"]
+    for key, group in df.groupby(keys):
+        n = len(group)
+        if n < 2:
+            continue
+        sims = cosine_matrix(vectors[group.index.to_numpy()])
+        mean_sim = (sims.sum() - np.trace(sims)) / (n * (n - 1))
+        rows.append({**dict(zip(keys, key)), "tasks": n, "mean_similarity": float(mean_sim),
+                     "diversity": float(1 - mean_sim)})
+    return pd.DataFrame(rows)
+
+
+# Sovrapposizione tra modelli: quota di task del modello A con un task "equivalente"
+# (similarita' >= threshold) tra quelli generati dal modello B per lo stesso sistema
+def cross_model_overlap(df: pd.DataFrame, vectors: np.ndarray, threshold: float) -> pd.DataFrame:
+    rows = []
+    for system, group in df.groupby("system"):
+        by_model = {m: g.index.to_numpy() for m, g in group.groupby("model")}
+        for model_a, idx_a in by_model.items():
+            for model_b, idx_b in by_model.items():
+                if model_a == model_b:
+                    continue
+                best = cosine_matrix(vectors[idx_a], vectors[idx_b]).max(axis=1)
+                rows.append({"system": system, "model_a": model_a, "model_b": model_b,
+                             "overlap": float((best >= threshold).mean()),
+                             "mean_best_similarity": float(best.mean())})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Similarity analysis of the generated tasks")
+    parser.add_argument("--root", default=RESULTS_DIR)
+    parser.add_argument("--out", default=EXPORT_DIR)
+    parser.add_argument("--system", default=None, help="analyse a single system only")
+    parser.add_argument("--embed-model", default=EMBED_MODEL)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--base-url", default="http://localhost:11434/v1/")
+    args = parser.parse_args()
+
+    tasks = load_tasks(args.root)
+    if args.system:
+        tasks = tasks[tasks["system"] == args.system]
+    tasks = tasks.reset_index(drop=True)
+
+    raw_client = RawOpenAI(base_url=args.base_url, api_key="ollama")
+    vectors = embed_texts(tasks["task"].tolist(), raw_client, args.embed_model, args.batch_size)
+
+    os.makedirs(args.out, exist_ok=True)
+    reports = {
+        "near_duplicates": near_duplicates(tasks, vectors, args.threshold),
+        "temperature_diversity": temperature_diversity(tasks, vectors),
+        "cross_model_overlap": cross_model_overlap(tasks, vectors, args.threshold),
+    }
+    for name, report in reports.items():
+        path = os.path.join(args.out, f"similarity_{name}.csv")
+        report.to_csv(path, index=False)
+        print(f"{name}: {len(report)} rows -> {path}")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I moduli di Shared si importano per nome, come dai loop dei due sistemi
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
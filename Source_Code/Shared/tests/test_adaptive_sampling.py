@@ -0,0 +1,72 @@
+import pytest
+
+from adaptive_sampling import AdaptiveSampler, task_list_similarity, task_variation
+
+
+def output(*tasks: str) -> str:
+    return "Reasoning:\nsome reasoning\n\nTasks:\n" + "\n".join(f"- {t}" for t in tasks)
+
+
+SAME = output("Register a new patient", "Review the last diagnosis")
+# Nessuna parola in comune con SAME
+OTHER = output("Export cell report", "Change classification threshold")
+
+
+def test_task_list_similarity():
+    assert task_list_similarity(["a b"], ["a b"]) == 1.0
+    assert task_list_similarity(["a b"], ["c d"]) == 0.0
+    assert task_list_similarity([], []) == 1.0
+    assert task_list_similarity(["a"], []) == 0.0
+    assert task_list_similarity(["a b"], ["a c"]) == pytest.approx(1 / 3)
+
+
+def test_task_variation():
+    assert task_variation([SAME, SAME, SAME]) == 0.0
+    assert task_variation([SAME, OTHER]) == 1.0
+    # Con una sola generazione non si puo' misurare
+    assert task_variation([SAME]) == 1.0
+
+
+def test_first_round_covers_the_coarse_grid():
+    sampler = AdaptiveSampler([0.0, 1.0], min_generations=2)
+    assert sampler.next_round() == [(0.0, 1), (0.0, 2), (1.0, 1), (1.0, 2)]
+    assert sampler.calls == 0
+
+
+def test_converged_temperature_stops_and_unstable_one_samples_more():
+    sampler = AdaptiveSampler([0.0, 1.0], min_generations=2, max_generations=3, refine_delta=2.0)
+    for t, gen in sampler.next_round():
+        sampler.record(t, gen, SAME if t == 0.0 or gen == 1 else OTHER)
+    decisions = {d["temperature"]: d["action"] for d in sampler.decide()}
+    assert decisions == {0.0: "converged", 1.0: "sample_more"}
+    assert sampler.next_round() == [(1.0, 3)]
+
+    sampler.record(1.0, 3, OTHER)
+    assert sampler.decide()[0]["action"] == "budget"
+    assert sampler.done
+    assert sampler.calls == 5
+    assert sampler.stopped == {0.0: "converged", 1.0: "budget"}
+
+
+def test_refines_between_temperatures_with_different_variation():
+    sampler = AdaptiveSampler([0.0, 1.0], min_generations=2, refine_delta=0.2, min_step=0.1)
+    for t, gen in sampler.next_round():
+        sampler.record(t, gen, SAME if t == 0.0 or gen == 1 else OTHER)
+    actions = [d["action"] for d in sampler.decide()]
+    assert "refine_between_0.0_1.0" in actions
+    assert sampler.temperatures == [0.0, 0.5, 1.0]
+    assert (0.5, 1) in sampler.next_round() and (0.5, 2) in sampler.next_round()
+
+
+def test_no_refinement_below_the_minimum_step():
+    sampler = AdaptiveSampler([0.0, 0.1], min_generations=2, refine_delta=0.2, min_step=0.1)
+    for t, gen in sampler.next_round():
+        sampler.record(t, gen, SAME if t == 0.0 or gen == 1 else OTHER)
+    assert not any(d["action"].startswith("refine") for d in sampler.decide())
+    assert sampler.temperatures == [0.0, 0.1]
+
+
+def test_temperatures_are_rounded():
+    sampler = AdaptiveSampler([0.30000000000000004], min_generations=1)
+    sampler.record(0.3, 1, SAME)
+    assert sampler.outputs == {0.3: {1: SAME}}
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+from completion_index import CompletionIndex
+
+
+def fingerprint(gen: int) -> str:
+    return f"key-{gen}"
+
+
+def test_missing_and_resume_from_disk(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    index = CompletionIndex(path)
+    index.record_run("run", "A")
+    index.record_generation("run", "A", 1, "key-1")
+    index.record_generation("run", "A", 3, "key-3")
+    index.record_closed("A", "FINISHED")
+
+    reloaded = CompletionIndex(path)
+    assert reloaded.run_ids == {"run": "A"}
+    assert reloaded.closed == {"A": "FINISHED"}
+    assert reloaded.missing("run", 4, fingerprint) == [2, 4]
+    assert reloaded.missing("other", 2) == [1, 2]
+
+
+def test_changed_fingerprint_counts_as_missing(tmp_path):
+    index = CompletionIndex(str(tmp_path / "index.jsonl"))
+    index.record_run("run", "A")
+    index.record_generation("run", "A", 1, "key-1")
+    index.record_generation("run", "A", 2, "old-2")
+    assert index.is_done("run", 2)
+    assert not index.is_done("run", 2, "key-2")
+    assert index.missing("run", 2, fingerprint) == [2]
+    assert index.changed("run", 2, fingerprint)
+    assert not index.changed("run", 1, fingerprint)
+
+
+def test_new_run_with_the_same_name_drops_the_old_generations(tmp_path):
+    path = str(tmp_path / "index.jsonl")
+    index = CompletionIndex(path)
+    index.record_run("run", "A")
+    index.record_generation("run", "A", 1, "old-1")
+    index.record_run("run_2", "C")
+    index.record_generation("run_2", "C", 1, "key-1")
+    index.record_run("run", "B")
+    for reloaded in (index, CompletionIndex(path)):
+        assert reloaded.run_ids["run"] == "B"
+        assert reloaded.missing("run", 1) == [1]
+        # "run_2" non e' una generazione di "run"
+        assert reloaded.is_done("run_2", 1, "key-1")
+    # Riaprire la stessa run non cancella nulla
+    index.record_generation("run", "B", 1, "key-1")
+    index.record_run("run", "B")
+    assert index.is_done("run", 1, "key-1")
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    path = tmp_path / "index.jsonl"
+    index = CompletionIndex(str(path))
+    index.record_generation("run", "A", 1, "key-1")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"event": "generation", "run_name": "run", "run_id": "A", "ge')
+    reloaded = CompletionIndex(str(path))
+    assert reloaded.missing("run", 2, fingerprint) == [2]
+
+
+class FakeClient:
+    def __init__(self, runs: list, artifacts: dict):
+        self.runs = runs
+        self.artifacts = artifacts
+
+    def search_runs(self, experiment_ids, max_results=1000):
+        return self.runs
+
+    def list_artifacts(self, run_id):
+        return [SimpleNamespace(path=p) for p in self.artifacts.get(run_id, [])]
+
+
+def fake_run(run_id: str, run_name: str, **tags) -> SimpleNamespace:
+    return SimpleNamespace(info=SimpleNamespace(run_id=run_id, run_name=run_name), data=SimpleNamespace(tags=tags))
+
+
+def test_from_mlflow_reads_outputs_and_fingerprints(tmp_path):
+    client = FakeClient(
+        [
+            fake_run("new", "run", supersedes_run_id="old", generation_key_gen_1="key-1"),
+            fake_run("old", "run", generation_key_gen_1="old-1", generation_key_gen_2="old-2"),
+            fake_run("inputs", "input_images", run_type="inputs"),
+        ],
+        {
+            "new": ["output_zero_shot_gen_1.txt", "phase_spans.json"],
+            "old": ["output_zero_shot_gen_1.txt", "output_zero_shot_gen_2.txt"],
+            "inputs": ["output_x_gen_1.txt"],
+        },
+    )
+    index = CompletionIndex.from_mlflow(str(tmp_path / "index.jsonl"), client, "1")
+    assert index.run_ids == {"run": "new"}
+    assert index.missing("run", 2, fingerprint) == [2]
+    assert "input_images" not in index.run_ids
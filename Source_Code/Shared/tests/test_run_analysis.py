@@ -0,0 +1,75 @@
+import math
+import statistics
+
+import pytest
+
+from run_analysis import FEATURES, Aggregates, FeatureStore
+
+
+def record(key: str, fingerprint: str, temperature: float = 0.5, value: float = 1.0) -> dict:
+    return {"key": key, "fingerprint": fingerprint, "system": "BrainMed", "model": "m",
+            "prompt_type": "zero_shot", "temperature": temperature, **{f: value for f in FEATURES}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FeatureStore(str(tmp_path))
+
+
+def add(aggregates: Aggregates, store: FeatureStore, rec: dict) -> bool:
+    store.put(rec)
+    return aggregates.update(rec, store)
+
+
+def test_mean_and_sample_std(tmp_path, store):
+    aggregates = Aggregates(str(tmp_path))
+    values = [2.0, 4.0, 9.0]
+    for i, value in enumerate(values):
+        add(aggregates, store, record(f"run#{i}", f"f{i}", value=value))
+    row = aggregates.table().iloc[0]
+    assert row["generations"] == 3
+    assert row["task_count_mean"] == pytest.approx(statistics.mean(values))
+    assert row["task_count_std"] == pytest.approx(statistics.stdev(values))
+
+
+def test_rewritten_generation_replaces_its_contribution(tmp_path, store):
+    aggregates = Aggregates(str(tmp_path))
+    add(aggregates, store, record("run#1", "f1", value=2.0))
+    add(aggregates, store, record("run#2", "f2", value=4.0))
+    assert not aggregates.update(record("run#2", "f2", value=4.0), store)
+    assert add(aggregates, store, record("run#2", "f2b", value=10.0))
+    row = aggregates.table().iloc[0]
+    assert row["generations"] == 2
+    assert row["task_count_mean"] == pytest.approx(6.0)
+    assert row["task_count_std"] == pytest.approx(statistics.stdev([2.0, 10.0]))
+
+
+def test_removing_every_generation_drops_the_group(tmp_path, store):
+    aggregates = Aggregates(str(tmp_path))
+    add(aggregates, store, record("run#1", "f1", temperature=0.0))
+    add(aggregates, store, record("run#2", "f2", temperature=1.0))
+    aggregates.remove("run#1", store)
+    table = aggregates.table()
+    assert list(table["temperature"]) == [1.0]
+    assert aggregates.included == {"run#2": "f2"}
+
+
+def test_single_generation_has_zero_std(tmp_path, store):
+    aggregates = Aggregates(str(tmp_path))
+    add(aggregates, store, record("run#1", "f1", value=3.0))
+    assert aggregates.table().iloc[0]["task_count_std"] == 0.0
+
+
+def test_state_survives_a_reload(tmp_path, store):
+    aggregates = Aggregates(str(tmp_path))
+    add(aggregates, store, record("run#1", "f1", value=2.0))
+    add(aggregates, store, record("run#2", "f2", value=5.0))
+    aggregates.save()
+
+    reloaded = Aggregates(str(tmp_path))
+    reloaded_store = FeatureStore(str(tmp_path))
+    reloaded.remove("run#1", reloaded_store)
+    row = reloaded.table().iloc[0]
+    assert row["generations"] == 1
+    assert row["task_count_mean"] == pytest.approx(5.0)
+    assert math.isclose(row["task_count_std"], 0.0)
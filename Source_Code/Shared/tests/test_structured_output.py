@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from structured_output import StructuredOutputError, TaskStream
+
+
+def stream(text: str, chunk_size: int, reasoning_chars: int = 600) -> TaskStream:
+    validator = TaskStream(reasoning_chars)
+    for i in range(0, len(text), chunk_size):
+        validator.feed(text[i:i + chunk_size])
+    return validator
+
+
+OUTPUT = json.dumps({
+    "reasoning": 'The "Add Patient" flow is central, see \\ and "quotes".',
+    "tasks": ["Register a new patient", 'Find the "latest" diagnosis', "Ask the assistant about the éxplanation"],
+})
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, len(OUTPUT)])
+def test_chunk_boundaries_do_not_change_the_result(chunk_size):
+    validator = stream(OUTPUT, chunk_size)
+    reasoning, tasks = validator.finish()
+    assert validator.tasks == json.loads(OUTPUT)["tasks"]
+    assert tasks == validator.tasks
+    assert reasoning == json.loads(OUTPUT)["reasoning"]
+
+
+def test_escaped_quotes_split_across_chunks():
+    text = '{"reasoning": "a \\"b\\" c", "tasks": ["say \\"hi\\""]}'
+    cut = text.index('\\"hi') + 1    # il chunk finisce subito dopo il backslash
+    validator = TaskStream()
+    validator.feed(text[:cut])
+    assert validator.escape
+    validator.feed(text[cut:])
+    assert validator.tasks == ['say "hi"']
+    assert validator.finish() == ('a "b" c', ['say "hi"'])
+
+
+def test_tasks_are_collected_while_streaming():
+    validator = TaskStream()
+    validator.feed('{"reasoning": "r", "tasks": ["first", "sec')
+    assert validator.tasks == ["first"]
+    validator.feed('ond"]}')
+    assert validator.tasks == ["first", "second"]
+
+
+def test_extra_field_stops_the_stream():
+    validator = TaskStream()
+    with pytest.raises(StructuredOutputError, match="unexpected field 'notes'"):
+        validator.feed('{"reasoning": "r", "notes": "x", "tasks": ["a"]}')
+
+
+def test_nested_objects_in_tasks_are_rejected():
+    with pytest.raises(StructuredOutputError, match="list of strings"):
+        stream('{"reasoning": "r", "tasks": [{"task": "a"}]}', 4)
+
+
+def test_empty_task_is_rejected():
+    with pytest.raises(StructuredOutputError, match="empty task"):
+        stream('{"reasoning": "r", "tasks": ["a", "  "]}', 5)
+
+
+def test_text_before_or_after_the_object_is_rejected():
+    with pytest.raises(StructuredOutputError, match="does not start"):
+        stream('Here is the JSON: {"tasks": ["a"]}', 3)
+    with pytest.raises(StructuredOutputError, match="after the JSON object"):
+        stream('{"reasoning": "r", "tasks": ["a"]} done', 3)
+
+
+def test_truncated_output_fails_on_finish():
+    validator = stream(OUTPUT[:len(OUTPUT) // 2], 5)
+    with pytest.raises(StructuredOutputError, match="incomplete"):
+        validator.finish()
+
+
+def test_overlong_reasoning_stops_before_the_string_closes():
+    validator = TaskStream(reasoning_chars=10)
+    with pytest.raises(StructuredOutputError, match="reasoning longer"):
+        validator.feed('{"reasoning": "' + "x" * 50)
+
+
+def test_reasoning_over_the_limit_fails_on_finish():
+    validator = stream('{"reasoning": "' + "x" * 15 + '", "tasks": ["a"]}', 4, reasoning_chars=10)
+    with pytest.raises(StructuredOutputError, match="reasoning longer"):
+        validator.finish()
+
+
+def test_whitespace_around_the_object_is_accepted():
+    validator = stream('\n  {"tasks" : [ "a" ] }\n', 2, reasoning_chars=0)
+    assert validator.finish() == ("", ["a"])
@@ -0,0 +1,335 @@
+import argparse
+import csv
+import glob
+import importlib.util
+import math
+import os
+import re
+
+import httpx
+import mlflow
+from PIL import Image
+
+from html_outline import estimate_tokens, load_html_paths
+from image_selection import select_images
+from model_scheduler import OLLAMA_URL
+from prefix_planner import split_sections
+from results_store import EXPORT_DIR
+
+ROOT = os.path.join("..", "..")
+MODELS = ["llama3.2-vision:11b", "gemma3:12b", "qwen2.5vl:latest"]
+# Finestra di contesto con cui il loop esegue i modelli (num_ctx in loop_temp_prompt.py)
+NUM_CTX = 16384
+EXAMPLES_RE = re.compile(r"^[ \t]*(Examples of tasks|An example of task)", re.M | re.I)
+PLACEHOLDER_RE = re.compile(r"\{(image|html_snippet)\}")
+
+
+def _mllama_image_tokens(width: int, height: int) -> int:
+    # Fino a 4 tile da 560x560, ciascuna 40x40 patch + CLS
+    return min(4, math.ceil(width / 560) * math.ceil(height / 560)) * 1601
+
+
+def _qwen_image_tokens(width: int, height: int, factor: int = 28,
+                       min_pixels: int = 56 * 56, max_pixels: int = 28 * 28 * 1280) -> int:
+    h = max(factor, round(height / factor) * factor)
+    w = max(factor, round(width / factor) * factor)
+    if h * w > max_pixels:
+        beta = math.sqrt(height * width / max_pixels)
+        h = math.floor(height / beta / factor) * factor
+        w = math.floor(width / beta / factor) * factor
+    elif h * w < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h = math.ceil(height * beta / factor) * factor
+        w = math.ceil(width * beta / factor) * factor
+    return (h // factor) * (w // factor)
+
+
+# Per famiglia di modello: tokenizer (repo Hugging Face senza gate), token per immagine e
+# lunghezza massima del contesto. llama3.2-vision elabora le immagini in cross-attention:
+# costano tempo di prompt-eval ma nel contesto occupano un solo token.
+MODEL_SPECS = {
+    "llama3.2-vision": {
+        "tokenizer": "unsloth/Llama-3.2-11B-Vision-Instruct",
+        "image_tokens": _mllama_image_tokens,
+        "image_in_context": False,
+        "context_length": 131072,
+    },
+    "gemma3": {
+        "tokenizer": "unsloth/gemma-3-12b-it",
+        "image_tokens": lambda width, height: 256,
+        "image_in_context": True,
+        "context_length": 131072,
+    },
+    "qwen2.5vl": {
+        "tokenizer": "Qwen/Qwen2.5-VL-7B-Instruct",
+        "image_tokens": _qwen_image_tokens,
+        "image_in_context": True,
+        "context_length": 128000,
+    },
+}
+
+
+def model_spec(model: str) -> dict:
+    return MODEL_SPECS[model.split(":")[0]]
+
+
+# Conta i token con il tokenizer del modello; se non e' disponibile (pacchetto tokenizers
+# mancante o niente rete) ripiega sulla stima di 4 caratteri per token
+class TokenCounter:
+    def __init__(self, model: str):
+        repo = model_spec(model)["tokenizer"]
+        self.name = "estimate"
+        self.tokenizer = None
+        try:
+            from tokenizers import Tokenizer
+            self.tokenizer = Tokenizer.from_pretrained(repo)
+            self.name = repo
+        except Exception as exc:
+            print(f"[{model}] tokenizer {repo} not available ({exc}), using the chars/4 estimate")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return estimate_tokens(text)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+# Contesto massimo dichiarato dal modello in Ollama (/api/show), altrimenti quello noto
+def model_context_length(model: str, base_url: str = OLLAMA_URL) -> int:
+    try:
+        response = httpx.post(f"{base_url}/api/show", json={"model": model}, timeout=10)
+        response.raise_for_status()
+        for key, value in response.json().get("model_info", {}).items():
+            if key.endswith(".context_length"):
+                return int(value)
+    except (httpx.HTTPError, ValueError):
+        pass
+    return model_spec(model)["context_length"]
+
+
+# Separa gli esempi di task (one/few-shot) dal resto della sezione che li contiene
+def _split_examples(sections: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    result = []
+    for header, text in sections:
+        match = EXAMPLES_RE.search(text)
+        if match:
+            result.append((header, text[:match.start()].rstrip()))
+            result.append(("Examples", text[match.start():]))
+        else:
+            result.append((header, text))
+    return result
+
+
+def _prompt_type(name: str) -> str:
+    match = re.search(r"(zero|one|few)", name.lower())
+    return f"{match.group(1)}_shot" if match else "single"
+
+
+# Prompt in uso: i prompt_template dei moduli prompt_*.py di ogni Source_code_*
+def current_prompts(root: str = ROOT) -> list[dict]:
+    prompts = []
+    for folder in sorted(glob.glob(os.path.join(root, "Source_Code", "Source_code_*"))):
+        system = folder.rsplit("_", 1)[1]
+        for path in sorted(glob.glob(os.path.join(folder, "prompt_*.py"))):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            spec = importlib.util.spec_from_file_location(f"{system}_{stem}", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            prompts.append({
+                "version": "current", "system": system, "prompt_type": _prompt_type(stem),
+                "sections": _split_examples(split_sections(module.prompt_template.template)),
+            })
+    return prompts
+
+
+def _literal(source: str, name: str, values: dict) -> str:
+    match = re.search(rf'^{name}\s*=\s*\(?\s*f?"""(.*?)"""', source, re.M | re.S)
+    text = match.group(1) if match else ""
+    for key, value in values.items():
+        text = text.replace("{" + key + "}", value)
+    return text
+
+
+# Le iterazioni in Prompt_iterations sono copie testuali dei moduli (non sempre Python
+# valido): le sezioni si ricostruiscono dalla lista TEMPLATE e dalle variabili che cita.
+# Prompt_v1 e' testo libero diviso in blocchi SYSTEM / CONTENT.
+def iteration_prompt(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    version = re.search(r"Prompt_(v\d+)", path).group(1)
+    system = "BrainMed" if "BrainMed" in source or "brainmed" in path.lower() else "Anonymous"
+    template = re.search(r"^TEMPLATE\s*=(.*?)^\s*\]\)", source, re.M | re.S)
+    if template is None:
+        headers = list(re.finditer(r"^([A-Z]{4,})\s*$", source, re.M))
+        sections = [
+            (m.group(1), source[m.start():headers[i + 1].start() if i + 1 < len(headers) else len(source)].rstrip())
+            for i, m in enumerate(headers)
+        ]
+    else:
+        values = {k: v.rstrip('"') for k, v in re.findall(r'^(\w+)\s*=\s*"(.*)"\s*$', source, re.M)}
+        values.update(re.findall(r"^(\w+)\s*=\s*(\d+)\s*$", source, re.M))
+        sections = []
+        for line in template.group(1).splitlines():
+            match = re.match(r'\s*"\[([^\]]+)\](?:\\n)?(\{\w+\})?"(?:\s*\+\s*(\w+))?', line)
+            if not match:
+                continue
+            header, placeholder, name = match.groups()
+            text = placeholder or (_literal(source, name, values) if name else "")
+            sections.append((header, f"[{header}]\n{text}"))
+    return {
+        "version": version, "system": system,
+        "prompt_type": _prompt_type(os.path.basename(path)),
+        "sections": _split_examples(sections),
+    }
+
+
+def iteration_prompts(root: str = ROOT) -> list[dict]:
+    paths = glob.glob(os.path.join(root, "Prompt_iterations", "**", "*.txt"), recursive=True)
+    return [iteration_prompt(path) for path in sorted(paths)]
+
+
+# Dimensioni delle immagini inviate davvero dal loop (selezione di image_selection.py: copie
+# scartate, quasi-duplicati ritagliati) dopo il ridimensionamento a max_side (come image_encoding.py)
+def image_sizes(folder: str, max_side: int = 1024, near_duplicates: str = "crop",
+                near_duplicate_distance: float = 0.2) -> list[tuple[str, int, int]]:
+    paths = [
+        path for path in glob.glob(os.path.join(folder, "*"))
+        if os.path.splitext(path.lower())[1] in (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+    ]
+    selection = select_images(paths, near_duplicates, near_duplicate_distance, max_side=max_side)
+    sizes = []
+    for path in selection.paths:
+        with Image.open(path) as img:
+            width, height = img.size
+        scale = min(1.0, max_side / max(width, height))
+        sizes.append((os.path.basename(path), round(width * scale), round(height * scale)))
+    return sizes
+
+
+def raw_html(folder: str) -> str:
+    pages = []
+    for path in load_html_paths(folder):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            pages.append(f.read())
+    return "\n".join(pages)
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", name).strip("_").lower()
+
+
+# Token per sezione e per immagine di un prompt per un modello, con il controllo sul
+# contesto: num_ctx e' la finestra con cui Ollama esegue il modello (oltre viene troncato)
+def profile_prompt(prompt: dict, model: str, counter: TokenCounter, images: list, html: str,
+                   context_length: int, num_ctx: int) -> tuple[dict, dict]:
+    spec = model_spec(model)
+    row = {
+        "version": prompt["version"], "system": prompt["system"], "prompt_type": prompt["prompt_type"],
+        "model": model, "token_counter": counter.name,
+    }
+    image_tokens = {}
+    text_tokens = 0
+    for header, text in prompt["sections"]:
+        placeholders = PLACEHOLDER_RE.findall(text)
+        text = PLACEHOLDER_RE.sub("", text)
+        if "html_snippet" in placeholders:
+            text += html
+        if "image" in placeholders:
+            for name, width, height in images:
+                image_tokens[name] = spec["image_tokens"](width, height)
+        tokens = counter.count(text)
+        key = f"tokens_{_slug(header)}"
+        row[key] = row.get(key, 0) + tokens
+        text_tokens += tokens
+    row["image_count"] = len(image_tokens)
+    row["tokens_images"] = sum(image_tokens.values())
+    row["tokens_total"] = text_tokens + row["tokens_images"]
+    row["context_tokens"] = text_tokens + (row["tokens_images"] if spec["image_in_context"] else len(image_tokens))
+    row["context_length"] = context_length
+    row["num_ctx"] = num_ctx
+    row["exceeds_num_ctx"] = row["context_tokens"] > num_ctx
+    row["exceeds_context_length"] = row["context_tokens"] > context_length
+    return row, {f"tokens_image_{_slug(name)}": tokens for name, tokens in image_tokens.items()}
+
+
+def profile_all(prompts: list[dict], models: list[str], root: str = ROOT, max_side: int = 1024,
+                num_ctx: int = NUM_CTX, base_url: str = OLLAMA_URL, near_duplicates: str = "crop",
+                near_duplicate_distance: float = 0.2) -> list[tuple[dict, dict]]:
+    images = {
+        system: image_sizes(os.path.join(root, "Source_Code", f"Source_code_{system}", "img"), max_side,
+                            near_duplicates, near_duplicate_distance)
+        for system in {p["system"] for p in prompts}
+    }
+    html = {
+        system: raw_html(os.path.join(root, "Prototypes", system.lower(), "html"))
+        for system in images
+    }
+    results = []
+    for model in models:
+        counter = TokenCounter(model)
+        context_length = model_context_length(model, base_url)
+        for prompt in prompts:
+            results.append(profile_prompt(
+                prompt, model, counter, images[prompt["system"]], html[prompt["system"]],
+                context_length, num_ctx,
+            ))
+    return results
+
+
+def log_to_mlflow(results: list[tuple[dict, dict]], experiment_name: str):
+    mlflow.set_experiment(experiment_name)
+    for row, image_tokens in results:
+        run_name = f"{row['version']}_{row['system']}_{row['prompt_type']}_{row['model']}"
+        with mlflow.start_run(run_name=run_name):
+            mlflow.set_tags({"prompt_version": row["version"], "system": row["system"]})
+            mlflow.log_params({**row, **image_tokens})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Token budget per prompt section, image and model")
+    parser.add_argument("--root", default=ROOT)
+    parser.add_argument("--models", nargs="+", default=MODELS)
+    parser.add_argument("--no-iterations", action="store_true", help="profile only the prompts in use")
+    parser.add_argument("--max-side", type=int, default=1024, help="same as image_max_side in the loop")
+    parser.add_argument("--num-ctx", type=int, default=NUM_CTX, help="context window Ollama runs the models with")
+    parser.add_argument("--near-duplicates", choices=["crop", "collapse", "keep"], default="crop",
+                        help="same as near_duplicates in the loop")
+    parser.add_argument("--near-duplicate-distance", type=float, default=0.2,
+                        help="same as near_duplicate_distance in the loop")
+    parser.add_argument("--base-url", default=OLLAMA_URL)
+    parser.add_argument("--tracking-uri", default="http://127.0.0.1:5000")
+    parser.add_argument("--experiment", default="Prompt_Token_Profile")
+    parser.add_argument("--no-mlflow", action="store_true")
+    parser.add_argument("--out", default=EXPORT_DIR)
+    args = parser.parse_args()
+
+    prompts = current_prompts(args.root)
+    if not args.no_iterations:
+        prompts += iteration_prompts(args.root)
+    results = profile_all(prompts, args.models, args.root, args.max_side, args.num_ctx, args.base_url,
+                          args.near_duplicates, args.near_duplicate_distance)
+
+    for row, _ in results:
+        flag = " EXCEEDS num_ctx" if row["exceeds_num_ctx"] else ""
+        flag += " EXCEEDS context length" if row["exceeds_context_length"] else ""
+        sections = ", ".join(
+            f"{k[len('tokens_'):]}={v}" for k, v in row.items()
+            if k.startswith("tokens_") and k not in ("tokens_total", "tokens_images")
+        )
+        print(f"{row['version']:>7} {row['system']:<9} {row['prompt_type']:<9} {row['model']:<20} "
+              f"total={row['tokens_total']:>6} images={row['tokens_images']:>6} ({sections}){flag}")
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, "prompt_token_profile.csv")
+    rows = [{**row, **image_tokens} for row, image_tokens in results]
+    fields = list(dict.fromkeys(k for row in rows for k in row))
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"{len(rows)} profiles -> {path}")
+
+    if not args.no_mlflow:
+        mlflow.set_tracking_uri(args.tracking_uri)
+        log_to_mlflow(results, args.experiment)
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from mlflow.entities import Metric, Param, RunTag
+from mlflow.tracking import MlflowClient
+
+from response_cache import file_sha256
+
+# Limiti di MLflow per una singola chiamata log_batch
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+MAX_TAGS_PER_BATCH = 100
+
+
+# Logging MLflow fuori dal percorso critico: parametri, metriche e tag vengono
+# accumulati per run e inviati con log_batch; testi, batch e chiusure delle run
+# passano da una coda servita da un thread in background (in ordine FIFO, quindi
+# una run viene chiusa solo dopo che tutti i suoi output sono stati scritti).
+class SweepTracker:
+    def __init__(self, client: MlflowClient, experiment_id: str, flush_every: int = 50):
+        self.client = client
+        self.experiment_id = experiment_id
+        self.flush_every = flush_every
+        self._buffers = defaultdict(lambda: {"metrics": [], "params": [], "tags": []})
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._errors = []
+        self._worker = threading.Thread(target=self._drain, name="mlflow-writer", daemon=True)
+        self._worker.start()
+
+    # --- creazione run (sincrona: serve il run_id) -------------------------------------
+    def create_run(self, run_name: str, tags: dict | None = None) -> str:
+        run = self.client.create_run(self.experiment_id, run_name=run_name, tags=tags or {})
+        return run.info.run_id
+
+    # --- API bufferizzata -----------------------------------------------------------
+    def log_param(self, run_id: str, key: str, value):
+        self._buffer(run_id, "params", Param(key, str(value)))
+
+    def log_params(self, run_id: str, params: dict):
+        for key, value in params.items():
+            self.log_param(run_id, key, value)
+
+    def log_metric(self, run_id: str, key: str, value: float, step: int = 0):
+        self._buffer(run_id, "metrics", Metric(key, float(value), int(time.time() * 1000), step))
+
+    def set_tag(self, run_id: str, key: str, value):
+        self._buffer(run_id, "tags", RunTag(key, str(value)))
+
+    def log_text(self, run_id: str, text: str, artifact_file: str):
+        self._queue.put((self.client.log_text, (run_id, text, artifact_file)))
+
+    # Esegue `fn` sul thread di logging dopo tutte le scritture gia' accodate
+    def after(self, fn, *args):
+        self._queue.put((fn, args))
+
+    def flush(self, run_id: str):
+        with self._lock:
+            buffer = self._buffers.pop(run_id, None)
+        if buffer:
+            self._queue.put((self._log_batch, (run_id, buffer)))
+
+    def terminate(self, run_id: str, status: str = "FINISHED"):
+        self.flush(run_id)
+        self._queue.put((self.client.set_terminated, (run_id, status)))
+
+    # Attende che la coda sia vuota; da chiamare a fine sweep
+    def close(self):
+        with self._lock:
+            run_ids = list(self._buffers)
+        for run_id in run_ids:
+            self.flush(run_id)
+        self._queue.join()
+        if self._errors:
+            print(f"MLflow writer: {len(self._errors)} logging calls failed, first: {self._errors[0]!r}")
+
+    def _buffer(self, run_id: str, kind: str, item):
+        with self._lock:
+            buffer = self._buffers[run_id]
+            buffer[kind].append(item)
+            size = sum(len(v) for v in buffer.values())
+        if size >= self.flush_every:
+            self.flush(run_id)
+
+    def _log_batch(self, run_id: str, buffer: dict):
+        metrics, params, tags = buffer["metrics"], buffer["params"], buffer["tags"]
+        while metrics or params or tags:
+            self.client.log_batch(
+                run_id,
+                metrics=metrics[:MAX_METRICS_PER_BATCH],
+                params=params[:MAX_PARAMS_PER_BATCH],
+                tags=tags[:MAX_TAGS_PER_BATCH],
+            )
+            metrics = metrics[MAX_METRICS_PER_BATCH:]
+            params = params[MAX_PARAMS_PER_BATCH:]
+            tags = tags[MAX_TAGS_PER_BATCH:]
+
+    def _drain(self):
+        while True:
+            fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception as exc:
+                self._errors.append(exc)
+            finally:
+                self._queue.task_done()
+
+    # --- immagini di input, una sola volta per sweep --------------------------------
+    # Le immagini vengono salvate come artifact content-addressed (images/<sha256>.<ext>)
+    # in una run "inputs" dedicata, riutilizzata se lo stesso insieme e' gia' stato caricato.
+    # Restituisce i tag da applicare alle run della sweep per referenziarle.
+    def log_input_images(self, paths: list[str], sweep_name: str) -> dict:
+        hashes = {os.path.basename(p): file_sha256(p) for p in paths}
+        set_hash = hashlib.sha256(
+            json.dumps(sorted(hashes.values())).encode("utf-8")
+        ).hexdigest()
+
+        existing = self.client.search_runs(
+            [self.experiment_id],
+            filter_string=f"tags.input_set_hash = '{set_hash}' and tags.run_type = 'inputs' and attributes.status = 'FINISHED'",
+            max_results=1,
+        )
+        if existing:
+            inputs_run_id = existing[0].info.run_id
+        else:
+            inputs_run_id = self.create_run(
+                f"inputs_{sweep_name}",
+                tags={"run_type": "inputs", "input_set_hash": set_hash},
+            )
+            for path in paths:
+                ext = os.path.splitext(path)[1].lower()
+                self._queue.put((self._log_image, (inputs_run_id, path, f"{hashes[os.path.basename(path)]}{ext}")))
+            self._queue.put((self.client.log_dict, (inputs_run_id, hashes, "images/index.json")))
+            self._queue.put((self.client.set_terminated, (inputs_run_id, "FINISHED")))
+
+        return {
+            "input_images_run_id": inputs_run_id,
+            "input_set_hash": set_hash,
+            "input_images": json.dumps(hashes, sort_keys=True),
+        }
+
+    def _log_image(self, run_id: str, path: str, name: str):
+        # log_artifact usa il nome del file: passiamo da una copia con il nome hash
+        with tempfile.TemporaryDirectory() as tmp:
+            target = os.path.join(tmp, name)
+            shutil.copyfile(path, target)
+            self.client.log_artifact(run_id, target, artifact_path="images")
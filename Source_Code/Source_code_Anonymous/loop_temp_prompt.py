@@ -1,29 +1,185 @@
 import os
+import sys
 import json, time
+import asyncio
+from collections import Counter, defaultdict
 import mlflow
-from openai import OpenAI as RawOpenAI
+from mlflow.exceptions import MlflowException
+from mlflow.tracking import MlflowClient
 from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
+from langchain_ollama import ChatOllama
+
+# Per sistema restano solo questo loop e i template dei prompt: tutti gli altri moduli
+# sono comuni e stanno, in una sola copia, in Source_Code/Shared
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Shared"))
 
 # Import con alias per non sovrascrivere i nomi
 import prompt_zero_shot as zero_shot
 import prompt_one_shot as one_shot
 import prompt_few_shot as few_shot
+from sweep_executor import GridCell, run_grid
+from response_cache import ResponseCache, file_sha256, generation_key
+from image_encoding import IMAGE_SENTINEL, encode_images, image_message_parts, multimodal_prompt
+from image_selection import select_images
+from model_scheduler import ModelLoad, run_model_groups
+from tracking import SweepTracker
+from streaming import percentile, stream_generation
+from completion_index import CompletionIndex
+from results_store import RESULTS_DIR, append_output, generation_files, parse_output
+from adaptive_sampling import AdaptiveSampler
+from prefix_planner import plan_cells, shared_prefix_templates
+from html_outline import cached_outline, estimate_tokens, html_prompt, load_html_paths
+from phase_timing import PHASES, PhaseSummary, generation_spans, phase_times, server_timing
+from endpoint_pool import EndpointPool, endpoint_slug, is_endpoint_error
+from local_tracking import LOG_DIR, RunLog
+from structured_output import StructuredOutputError, TaskStream, TruncatedOutputError, json_format, structured_prompt, structured_template, tasks_schema, validate_structured
+from tail_control import TailPolicy
 
-# MLflow setup
-mlflow.set_tracking_uri("http://127.0.0.1:5000")
-mlflow.set_experiment("Prompt_Comparison-anonymous-img")
-mlflow.openai.autolog()
-
-# (Opzionale) Raw client per embedding o moderazione
-raw_client = RawOpenAI(
-    base_url="http://localhost:11434/v1/",
-    api_key="ollama"
-)
+# Nomi definiti prima della configurazione: quelli aggiunti dopo sono le variabili
+# che SWEEP_OVERRIDES puo' sovrascrivere
+names_before_config = set(globals())
 
+tracking_uri = "http://127.0.0.1:5000"
+experiment_name = "Prompt_Comparison-anonymous-img"
+ollama_url = "http://localhost:11434"
 models = ["llama3.2-vision:11b", "gemma3:12b", "qwen2.5vl:latest"]
 model_choice = 0
+# True: esegue in un'unica invocazione la griglia di tutti i modelli in `models`,
+# un modello alla volta; False: solo models[model_choice]
+run_all_models = False
+# Quanto resta residente il modello caricato esplicitamente e se scaricarlo a fine gruppo
+keep_alive = "30m"
+unload_between_models = True
 num_generations = 10
+temperatures = [i * 0.1 for i in range(11)]
+# Numero massimo di chiamate contemporanee verso Ollama (1 = sweep seriale).
+# Per sfruttarlo lato server avviare Ollama con OLLAMA_NUM_PARALLEL >= max_concurrency.
+max_concurrency = 4
+# Seed passato al modello (None = nessun seed); fa parte della chiave di cache
+seed = None
+# Cache delle risposte su disco: refresh_cache=True ignora le voci esistenti e le riscrive
+use_cache = True
+refresh_cache = False
+cache_max_bytes = 256 * 1024 * 1024
+# "encoded": screenshot ridimensionati e inviati come parti immagine base64;
+# "paths": comportamento originale, nello slot {image} finisce la lista dei path
+image_mode = "encoded"
+image_max_side = 1024
+image_format = "JPEG"
+image_quality = 85
+# Selezione degli screenshot (image_selection.py): cartelle lette in ordine (le copie
+# identiche vengono inviate una volta sola), quasi-duplicati per dhash ritagliati sulla zona
+# che cambia ("crop"), scartati ("collapse") o inviati interi ("keep"), e budget del prompt
+# in immagini e token stimati (None = nessun limite). L'ordine di invio e' deterministico.
+image_dirs = ["img"]
+near_duplicates = "crop"
+near_duplicate_distance = 0.2
+max_images = None
+image_token_budget = None
+# Cosa finisce nello slot {image}: "images" (screenshot) e/o "html" (outline compatto delle
+# pagine HTML del prototipo, entro html_token_budget). Con entrambe le modalita' la stessa
+# sweep esegue la griglia due volte, per confrontare qualita' dei task e latenza.
+input_modes = ["images"]
+html_dir = "../../Prototypes/anonymous/html"
+html_token_budget = 2000
+# Formato dell'output: "text" (sezioni Reasoning e Tasks come nel paper) e/o "json" (oggetto
+# {"reasoning", "tasks"} vincolato da uno schema JSON: `format` di Ollama o response_format
+# OpenAI, validato durante lo streaming). Le varianti json si chiamano "<variante>_json" e,
+# con entrambi i formati, vengono confrontate in token generati e latenza a fine modello.
+output_formats = ["text"]
+# Lunghezza massima del reasoning nell'output json (0 = solo la lista dei task)
+json_reasoning_chars = 600
+# Streaming: misura time-to-first-token e token/s e scrive l'output in stream_dir man mano
+streaming = True
+stream_dir = "outputs"
+# Ripresa di una sweep interrotta: vengono eseguite solo le generazioni mancanti
+# secondo l'indice locale (resume_from_mlflow=True lo ricostruisce dall'esperimento).
+# Una generazione salvata con un prompt, un seed o immagini diversi da quelli attuali
+# conta come mancante, come tutte con refresh_cache = True
+resume = True
+resume_from_mlflow = False
+# Task estratti da ogni output e aggiunti al dataset Parquet in Results/tasks_dataset
+store_results = True
+results_dir = RESULTS_DIR
+# "grid": tutte le `temperatures` x num_generations; "adaptive": parte da adaptive_coarse,
+# aggiunge generazioni/temperature dove i task variano e si ferma dove convergono
+# (al massimo num_generations generazioni per temperatura, vedi adaptive_sampling.py)
+sampling = "grid"
+adaptive_coarse = [0.0, 0.5, 1.0]
+adaptive_min_generations = 2
+adaptive_stable_threshold = 0.15
+adaptive_refine_delta = 0.2
+# Pianificazione per prefisso comune: un solo client per (modello, variante), una chiamata
+# di riscaldamento per variante prima delle altre e celle raggruppate per variante,
+# cosi' la cache di prompt-evaluation di Ollama viene riutilizzata tra le chiamate
+prefix_planning = True
+# "original": ordine delle sezioni come nei prompt del paper; "shared_prefix": prima le
+# sezioni identiche tra le varianti (Context, Screenshots, Structure), poi Request
+prompt_layout = "original"
+# Finestra di contesto fissa con cui Ollama esegue il modello (None = default del server,
+# 4096 token, in cui i prompt con gli screenshot non entrano e vengono troncati). Uguale per
+# tutte le varianti, cosi' il server non ricarica il modello e la cache del prefisso resta
+# valida. Solo con l'API nativa: l'endpoint OpenAI-compatibile ignora le options.
+num_ctx = 16384
+
+# "native": chiamate a /api/chat di Ollama (ChatOllama), che restituisce le durate di
+# caricamento, prompt-eval ed eval di ogni generazione; "openai": endpoint /v1
+# OpenAI-compatibile (ChatOpenAI), le fasi vengono stimate dal time-to-first-token
+ollama_api = "native"
+# Pool di server Ollama (es. piu' istanze avviate con OLLAMA_HOST su porte diverse): ogni
+# chiamata va al server sano con meno richieste in volo e, se il server non risponde,
+# viene ripetuta su un altro. Lista vuota = solo ollama_url
+ollama_endpoints = []
+health_check_interval = 10.0
+# "server": run e metriche sul server MLflow in tracking_uri; "local": nessun server, tutto
+# in un log append-only in local_log_dir/<experiment_name> (fsync a blocchi, vedi
+# local_tracking.py), da riversare poi in MLflow con `python local_tracking.py import`.
+# In modalita' locale l'autolog delle tracce e' disattivato.
+tracking_backend = "server"
+local_log_dir = LOG_DIR
+
+# Coda delle latenze: scadenza di ogni chiamata (secondi, None = nessuna) e token massimi
+# generati (None = limite del server); una chiamata scaduta, fallita su tutti gli endpoint
+# o con output json non valido viene ripetuta fino a max_retries volte, attendendo
+# retry_backoff * 2^n secondi. Con hedge_requests una chiamata che supera il p`hedge_quantile`
+# delle latenze osservate per (modello, variante, modalita') viene duplicata e vince la
+# prima risposta. Timeout, tentativi e duplicati vengono registrati come metriche della run.
+call_timeout = 600.0
+max_output_tokens = 2048
+max_retries = 2
+retry_backoff = 2.0
+hedge_requests = False
+hedge_quantile = 95
+hedge_min_samples = 5
+
+# Override della configurazione sopra senza modificare il file (usato da benchmark_harness.py),
+# es. SWEEP_OVERRIDES='{"max_concurrency": 8, "ollama_url": "http://127.0.0.1:11500"}'
+# Chiavi sconosciute (nomi sbagliati, funzioni, moduli) sono un errore, non vengono ignorate
+config_names = set(globals()) - names_before_config - {"names_before_config"}
+overrides = json.loads(os.environ.get("SWEEP_OVERRIDES", "{}"))
+unknown = sorted(set(overrides) - config_names)
+if unknown:
+    raise ValueError(f"Unknown SWEEP_OVERRIDES keys: {unknown}")
+globals().update(overrides)
+
+# MLflow setup
+if tracking_backend == "local":
+    client = RunLog(os.path.join(local_log_dir, experiment_name))
+    experiment = client.experiment
+else:
+    mlflow.set_tracking_uri(tracking_uri)
+    experiment = mlflow.set_experiment(experiment_name)
+    # Tracce di prompt e risposte: con l'API nativa le chiamate passano da ChatOllama e dal
+    # client ollama, che l'autolog OpenAI non vede, quindi le traccia l'autolog LangChain
+    if ollama_api == "native":
+        mlflow.langchain.autolog()
+    else:
+        mlflow.openai.autolog()
+    # Client esplicito: con piu' run aperte in parallelo non possiamo usare la run "attiva"
+    client = MlflowClient()
+# Parametri/metriche in log_batch, testi e chiusure run su un thread in background
+tracker = SweepTracker(client, experiment.experiment_id)
 
 # Raggruppa i tuoi prompt in un dict:
 prompt_variants = {
@@ -40,8 +196,20 @@ prompt_variants = {
         "text": few_shot.prompt_text
     }
 }
+# Varianti json: stesso prompt con la sezione Structure che chiede l'oggetto dello schema
+output_schema = tasks_schema(json_reasoning_chars)
+structured_variants = set()
+if "json" in output_formats:
+    for prompt_name in list(prompt_variants):
+        prompt_data = prompt_variants[prompt_name]
+        prompt_variants[f"{prompt_name}_json"] = {
+            "template": structured_template(prompt_data["template"], json_reasoning_chars),
+            "text": structured_prompt(prompt_data["text"], json_reasoning_chars),
+        }
+        structured_variants.add(f"{prompt_name}_json")
+if "text" not in output_formats:
+    prompt_variants = {n: d for n, d in prompt_variants.items() if n in structured_variants}
 
-# Funzione per caricare HTML
 # Funzione per caricare HTML
 def load_image_paths(folder: str = "img") -> list[str]:
     valid_exts = {".png", ".jpg", ".jpeg", ".gif", ".bmp"}
@@ -51,44 +219,703 @@ def load_image_paths(folder: str = "img") -> list[str]:
         if os.path.splitext(fname.lower())[1] in valid_exts
     ]
 
-# Loop su modello, tipo di prompt e temperature
-image_paths = load_image_paths("img")
-for prompt_name, prompt_data in prompt_variants.items():
+# Prepara una run MLflow per ogni coppia (prompt, temperatura) e una cella per generazione
+image_selection = select_images(
+    [p for folder in image_dirs for p in load_image_paths(folder)],
+    near_duplicates, near_duplicate_distance, max_images, image_token_budget, max_side=image_max_side
+)
+print(image_selection.summary())
+image_paths = image_selection.paths
+if image_mode == "encoded":
+    image_blobs = encode_images(
+        image_paths, max_side=image_max_side, fmt=image_format, quality=image_quality
+    )
+    image_input = image_message_parts(image_blobs)
+    # La chiave del blob include gia' hash del file e impostazioni di codifica
+    image_hashes = [b["key"] for b in image_blobs]
+    image_payload_bytes = sum(b["bytes"] for b in image_blobs)
+else:
+    image_input = image_paths
+    image_hashes = [file_sha256(p) for p in image_paths]
+    image_payload_bytes = sum(os.path.getsize(p) for p in image_paths)
+# Input per modalita': contenuto dello slot {image}, hash per la cache e dimensione
+model_inputs = {"images": image_input}
+input_hashes = {"images": image_hashes}
+input_payload_bytes = {"images": image_payload_bytes}
+if "html" in input_modes:
+    html_outline = cached_outline(html_dir, html_token_budget)
+    model_inputs["html"] = html_outline
+    input_hashes["html"] = [file_sha256(p) for p in load_html_paths(html_dir)]
+    input_payload_bytes["html"] = len(html_outline.encode("utf-8"))
+
+cache = ResponseCache(max_bytes=cache_max_bytes, refresh=refresh_cache) if use_cache else None
+rendered_prompts = {}
+prompt_inputs = {}
+for prompt_data in prompt_variants.values():
     # Assicuriamoci che il template prenda in input i path delle immagini
     prompt_data["template"].input_variables = ["image"]
+if prompt_layout == "shared_prefix":
+    reordered = shared_prefix_templates({n: d["template"] for n, d in prompt_variants.items()})
+    for prompt_name, template in reordered.items():
+        prompt_variants[prompt_name]["template"] = template
+for prompt_name, prompt_data in prompt_variants.items():
+    if image_mode == "encoded":
+        rendered_prompts[(prompt_name, "images")] = prompt_data["template"].format(image=IMAGE_SENTINEL)
+        prompt_inputs[(prompt_name, "images")] = multimodal_prompt(prompt_data["template"])
+    else:
+        rendered_prompts[(prompt_name, "images")] = prompt_data["template"].format(image=image_paths)
+        prompt_inputs[(prompt_name, "images")] = prompt_data["template"]
+    if "html" in input_modes:
+        # L'outline e' testo: va direttamente nel template testuale, con la sezione e la
+        # Request riferite all'outline invece che agli screenshot
+        html_template = PromptTemplate.from_template(html_prompt(prompt_data["template"].template))
+        rendered_prompts[(prompt_name, "html")] = html_template.format(image=html_outline)
+        prompt_inputs[(prompt_name, "html")] = html_template
+
+# Le immagini vengono caricate una sola volta, referenziate da ogni run tramite hash
+input_image_tags = tracker.log_input_images(image_paths, experiment.name)
+run_names = {}
+
+index_path = os.path.join(".cache", "sweeps", f"{experiment.name}.jsonl")
+if not resume and os.path.exists(index_path):
+    os.remove(index_path)
+if resume and resume_from_mlflow:
+    completion = CompletionIndex.from_mlflow(index_path, client, experiment.experiment_id)
+else:
+    completion = CompletionIndex(index_path)
+
+
+endpoints = EndpointPool(ollama_endpoints or [ollama_url], health_check_interval)
+# Client persistente per (endpoint, modello, variante): la temperatura viene passata per chiamata
+chat_clients = {}
+
+
+def chat_model(model: str, base_url: str, t: float | None = None):
+    if ollama_api == "native":
+        return ChatOllama(
+            model=model,
+            base_url=base_url,
+            temperature=t,
+            seed=seed,
+            num_predict=max_output_tokens,
+            num_ctx=num_ctx,
+            keep_alive=keep_alive
+        )
+    return ChatOpenAI(
+        model=model,
+        openai_api_base=f"{base_url}/v1",
+        openai_api_key="ollama",
+        temperature=t,
+        seed=seed,
+        max_tokens=max_output_tokens,
+        stream_usage=True
+    )
+
+
+# Schema dell'output per le varianti json, nel parametro dell'API in uso
+def format_kwargs(prompt_name: str) -> dict:
+    if prompt_name not in structured_variants:
+        return {}
+    if ollama_api == "native":
+        return {"format": output_schema}
+    return {"response_format": json_format(output_schema)}
 
-    for t in [i * 0.1 for i in range(11)]:
-        chat_llm = ChatOpenAI(
-            model=models[model_choice],
-            openai_api_base="http://localhost:11434/v1",
-            openai_api_key="ollama",
-            temperature=t
+
+# Modello per una chiamata verso un endpoint del pool
+def chat_llm(model: str, prompt_name: str, t: float, base_url: str):
+    if not prefix_planning:
+        if (base_url, model, t) not in chat_clients:
+            chat_clients[(base_url, model, t)] = chat_model(model, base_url, t)
+        client_llm = chat_clients[(base_url, model, t)]
+        return client_llm.bind(**format_kwargs(prompt_name)) if prompt_name in structured_variants else client_llm
+    if (base_url, model, prompt_name) not in chat_clients:
+        chat_clients[(base_url, model, prompt_name)] = chat_model(model, base_url)
+    client_llm = chat_clients[(base_url, model, prompt_name)]
+    if ollama_api == "native":
+        # Le options della richiesta sostituiscono quelle del client: temperatura, seed,
+        # limite di token e finestra di contesto vanno passati tutti qui
+        options = {"temperature": t} if seed is None else {"temperature": t, "seed": seed}
+        if max_output_tokens is not None:
+            options["num_predict"] = max_output_tokens
+        if num_ctx is not None:
+            options["num_ctx"] = num_ctx
+        return client_llm.bind(options=options, **format_kwargs(prompt_name))
+    return client_llm.bind(temperature=t, **format_kwargs(prompt_name))
+
+
+# Le run in modalita' "images" mantengono il nome originale
+def make_run_name(model: str, prompt_name: str, t: float, mode: str = "images") -> str:
+    suffix = "" if mode == "images" else f"_{mode}"
+    return f"{model}_{prompt_name}{suffix}_temp_{t:.1f}"
+
+
+# Apre (o riapre, se interrotta) la run MLflow di (modello, prompt, temperatura)
+def open_run(model: str, prompt_name: str, t: float, load: ModelLoad, mode: str = "images"):
+    run_name = make_run_name(model, prompt_name, t, mode)
+    previous = completion.run_ids.get(run_name)
+    if previous is not None and not completion.changed(
+            run_name, num_generations, lambda gen: cell_key(model, prompt_name, mode, t, gen)):
+        # Run interrotta con la configurazione attuale: la riapriamo invece di crearne un duplicato
+        run_id = previous
+        run_names[run_id] = run_name
+        client.update_run(run_id, status="RUNNING")
+        tracker.set_tag(run_id, "resumed", True)
+        return run_id, run_name
+
+    # Tag e parametri. Se la run precedente con questo nome e' stata generata con un'altra
+    # configurazione (seed, prompt, immagini, opzioni del modello) ne creiamo una nuova: i
+    # parametri MLflow non si possono modificare. L'indice la registra al posto della
+    # precedente, le cui righe vengono tolte dal dataset dei task.
+    tags = {"framework": "LangChain", "prompt_type": prompt_name, "input_mode": mode, **input_image_tags}
+    if previous is not None:
+        tags["supersedes_run_id"] = previous
+    run_id = tracker.create_run(run_name, tags=tags)
+    run_names[run_id] = run_name
+    completion.record_run(run_name, run_id)
+    if previous is not None and store_results:
+        for path in generation_files(results_dir, zero_shot.system_name, model, previous):
+            os.remove(path)
+    tracker.log_params(run_id, {
+        "model": model,
+        "temperature": t,
+        "num_generations": num_generations,
+        "max_concurrency": max_concurrency,
+        "seed": seed,
+        "use_cache": use_cache,
+        "image_mode": image_mode,
+        "streaming": streaming,
+        "sampling": sampling,
+        "prefix_planning": prefix_planning,
+        "prompt_layout": prompt_layout,
+        "input_mode": mode,
+        "ollama_api": ollama_api,
+        "ollama_endpoints": ",".join(endpoints.urls),
+        "output_format": "json" if prompt_name in structured_variants else "text",
+        "call_timeout": call_timeout,
+        "max_output_tokens": max_output_tokens,
+        "max_retries": max_retries,
+        "hedge_requests": hedge_requests,
+        "num_ctx": num_ctx if ollama_api == "native" else None,
+    })
+    if prompt_name in structured_variants:
+        tracker.log_param(run_id, "json_reasoning_chars", json_reasoning_chars)
+    if mode == "html":
+        tracker.log_param(run_id, "html_token_budget", html_token_budget)
+        tracker.log_metric(run_id, "html_outline_tokens_est", estimate_tokens(html_outline))
+    elif image_mode == "encoded":
+        tracker.log_param(run_id, "image_max_side", image_max_side)
+        tracker.log_param(run_id, "image_format", image_format)
+    if mode == "images":
+        tracker.log_params(run_id, {
+            "near_duplicates": near_duplicates,
+            "near_duplicate_distance": near_duplicate_distance,
+            "max_images": max_images,
+            "image_token_budget": image_token_budget,
+        })
+        tracker.log_metric(run_id, "images_sent", len(image_paths))
+        tracker.log_metric(run_id, "image_tokens_est", image_selection.tokens)
+    tracker.log_metric(run_id, "input_payload_bytes", input_payload_bytes[mode])
+    # Caricamento del modello misurato a parte, fuori dalle latenze di inferenza
+    tracker.log_metric(run_id, "model_load_time", load.wall_time)
+    tracker.log_metric(run_id, "model_load_duration", load.load_duration)
+    tracker.set_tag(run_id, "model_already_loaded", load.already_loaded)
+    return run_id, run_name
+
+
+# Combinazioni (modalita' di input, prompt, temperatura) della griglia
+def grid_keys():
+    return [(mode, prompt_name, t) for mode in input_modes for prompt_name in prompt_variants for t in temperatures]
+
+
+# Generazioni ancora da eseguire per una run: quelle mai salvate o salvate con un'impronta
+# diversa (prompt, seed o immagini cambiati); con refresh_cache tutte
+def missing_generations(model: str, prompt_name: str, t: float, mode: str) -> list[int]:
+    if refresh_cache:
+        return list(range(1, num_generations + 1))
+    return completion.missing(
+        make_run_name(model, prompt_name, t, mode), num_generations,
+        lambda gen: cell_key(model, prompt_name, mode, t, gen),
+    )
+
+
+# Crea le run MLflow (prompt x temperatura) di un modello e una cella per generazione
+def build_cells(model: str, load: ModelLoad) -> list[GridCell]:
+    cells = []
+    for mode, prompt_name, t in grid_keys():
+        run_name = make_run_name(model, prompt_name, t, mode)
+        missing = missing_generations(model, prompt_name, t, mode)
+        if not missing:
+            run_id = completion.run_ids[run_name]
+            if run_id not in completion.closed:
+                # Tutte le generazioni salvate ma crash prima della chiusura della run
+                tracker.terminate(run_id)
+                tracker.after(completion.record_closed, run_id, "FINISHED")
+            print(f"Run already completed, skipped: {run_name}")
+            continue
+        run_id, run_name = open_run(model, prompt_name, t, load, mode)
+        # Una run nuova (configurazione cambiata) riparte da tutte le generazioni
+        missing = missing_generations(model, prompt_name, t, mode)
+        for gen in missing:
+            cells.append(GridCell(run_id, run_name, model, prompt_name, t, gen, prompt_inputs[(prompt_name, mode)], mode))
+    return cells
+
+
+tail_policy = TailPolicy(
+    call_timeout, max_retries, retry_backoff, hedge_requests, hedge_quantile, hedge_min_samples,
+    retryable=lambda exc: is_endpoint_error(exc)
+    or (isinstance(exc, StructuredOutputError) and not isinstance(exc, TruncatedOutputError)),
+)
+# Timeout, tentativi ripetuti e richieste duplicate per run
+run_tail = defaultdict(Counter)
+
+
+# Motivo di fine generazione ("length" = troncata da max_output_tokens)
+def finish_reason(metadata: dict) -> str | None:
+    return metadata.get("done_reason") or metadata.get("finish_reason")
+
+
+# Validazione dell'output json; se la generazione e' stata interrotta da max_output_tokens
+# l'errore diventa TruncatedOutputError, che non viene ripetuto
+def check_structured(check, metadata: dict):
+    try:
+        check()
+    except StructuredOutputError as exc:
+        if finish_reason(metadata) == "length":
+            raise TruncatedOutputError(f"output truncated at {max_output_tokens} tokens: {exc}") from exc
+        raise
+
+
+# Chiamata al modello su un endpoint del pool (ripetuta su un altro se questo non risponde);
+# `label` distingue la chiamata principale dal duplicato dell'hedging
+async def invoke_model(cell: GridCell, prompt_value, base_url: str, label: str = "primary") -> dict:
+    llm = chat_llm(cell.model, cell.prompt_name, cell.temperature, base_url)
+    structured = cell.prompt_name in structured_variants
+    if streaming:
+        safe_name = cell.run_name.replace(":", "_").replace("/", "_")
+        suffix = "" if label == "primary" else f"_{label}"
+        # Output json non conforme: lo streaming si interrompe e la generazione fallisce
+        validator = TaskStream(json_reasoning_chars) if structured else None
+        result = await stream_generation(
+            llm, prompt_value,
+            sink_path=os.path.join(stream_dir, f"{safe_name}_gen_{cell.gen}{suffix}.txt"),
+            validator=validator,
         )
-        chain = prompt_data["template"] | chat_llm
-
-        run_name = f"{models[model_choice]}_{prompt_name}_temp_{t:.1f}"
-        with mlflow.start_run(run_name=run_name):
-            # Tag e parametri
-            mlflow.set_tag("framework", "LangChain")
-            mlflow.set_tag("prompt_type", prompt_name)
-            mlflow.log_param("model", models[model_choice])
-            mlflow.log_param("temperature", t)
-            mlflow.log_param("num_generations", num_generations)
-
-            # Log dei path immagini come artifact
-            # Registra l'intera cartella 'img' (tutte le immagini) per riferimento
-            mlflow.log_artifacts("img", artifact_path=f"input_images_{prompt_name}")
-
-            for gen in range(1, num_generations + 1):
-                start = time.time()
-                # Passiamo la lista di path al modello
-                answer = chain.invoke({"image": image_paths})
-                latency = time.time() - start
-
-                mlflow.log_text(
-                    answer.text(),
-                    f"output_{prompt_name}_gen_{gen}.txt",
-                )
-                mlflow.log_metric(f"latency_gen_{gen}", latency)
-
-        print(f"Run completed: model={models[model_choice]}, prompt={prompt_name}, temp={t:.1f}")
\ No newline at end of file
+        if validator is not None:
+            check_structured(validator.finish, result.metadata)
+        return {**result.as_entry(), "server": server_timing(result.metadata),
+                "finish_reason": finish_reason(result.metadata)}
+    start = time.perf_counter()
+    answer = await llm.ainvoke(prompt_value)
+    usage = answer.usage_metadata or {}
+    if structured:
+        check_structured(lambda: validate_structured(answer.text(), json_reasoning_chars), answer.response_metadata)
+    return {
+        "text": answer.text(),
+        "latency": time.perf_counter() - start,
+        "prompt_tokens": usage.get("input_tokens", 0),
+        "completion_tokens": usage.get("output_tokens", 0),
+        "server": server_timing(answer.response_metadata),
+        "finish_reason": finish_reason(answer.response_metadata),
+    }
+
+
+# Chiave di cache di una generazione, usata anche come impronta nell'indice di ripresa
+def cell_key(model: str, prompt_name: str, mode: str, t: float, gen: int) -> str:
+    return generation_key(
+        model, rendered_prompts[(prompt_name, mode)], t, seed, gen, input_hashes[mode],
+        options={"ollama_api": ollama_api, "max_output_tokens": max_output_tokens,
+                 "num_ctx": num_ctx if ollama_api == "native" else None},
+    )
+
+
+async def generate(cell: GridCell) -> dict:
+    key = cell_key(cell.model, cell.prompt_name, cell.input_mode, cell.temperature, cell.gen)
+    if cache is not None:
+        entry = cache.get(key, scope=cell.run_id)
+        if entry is not None:
+            return {**entry, "cached": True}
+
+    # Passiamo al modello le immagini codificate (o la lista di path in modalita' "paths")
+    # oppure l'outline HTML. Prompt e modello vengono eseguiti separatamente per
+    # misurare a parte il render del prompt e la chiamata HTTP.
+    start = time.perf_counter()
+    prompt_value = await cell.prompt.ainvoke({"image": model_inputs[cell.input_mode]})
+    render_time = time.perf_counter() - start
+    entry, url = await tail_policy.run(
+        (cell.model, cell.prompt_name, cell.input_mode),
+        lambda label: endpoints.run(lambda base_url: invoke_model(cell, prompt_value, base_url, label)),
+        on_event=lambda event: run_tail[cell.run_id].update([event]),
+    )
+    endpoints.record_tokens(url, entry["completion_tokens"])
+    # latency resta il tempo complessivo della generazione, come nelle sweep precedenti
+    entry["http_time"] = entry["latency"]
+    entry["latency"] += render_time
+    entry["render_time"] = render_time
+    entry["endpoint"] = url
+    # Le generazioni troncate da max_output_tokens non vengono messe in cache
+    if cache is not None and entry.get("finish_reason") != "length":
+        await asyncio.to_thread(cache.put, key, entry)
+    return {**entry, "cached": False}
+
+
+# La generazione e' segnata come completata solo dopo che l'output e' su MLflow. Il tag
+# dell'impronta viene scritto prima dell'output: con il backend locale log_text sincronizza
+# su disco anche il tag.
+def save_output(cell: GridCell, text: str):
+    key = cell_key(cell.model, cell.prompt_name, cell.input_mode, cell.temperature, cell.gen)
+    client.set_tag(cell.run_id, f"generation_key_gen_{cell.gen}", key)
+    client.log_text(cell.run_id, text, f"output_{cell.prompt_name}_gen_{cell.gen}.txt")
+    completion.record_generation(cell.run_name, cell.run_id, cell.gen, key)
+    if store_results:
+        append_output(
+            text, results_dir,
+            system=zero_shot.system_name, model=cell.model,
+            prompt_type=cell.prompt_name if cell.input_mode == "images" else f"{cell.prompt_name}_{cell.input_mode}",
+            temperature=cell.temperature, generation=cell.gen, run_id=cell.run_id,
+        )
+
+
+# Valori per generazione raccolti per run, per calcolare p50/p95 alla chiusura
+run_stats = defaultdict(lambda: defaultdict(list))
+# Celle di riscaldamento e loro tempo di prompt-eval "a freddo" per (modello, variante,
+# modalita'): la differenza con quello delle chiamate successive stima il prompt-eval
+# risparmiato grazie alla cache. Il tempo e' prompt_eval_duration di Ollama con l'API
+# nativa, altrimenti il TTFT.
+warmup_cells = set()
+cold_prompt_eval = {}
+# Fasi e span per run; i riepiloghi per modello contano solo le generazioni eseguite
+# davvero in questa sweep (non quelle servite dalla cache)
+run_spans = defaultdict(list)
+phase_summaries = defaultdict(PhaseSummary)
+# Generazioni servite da ciascun endpoint, per run
+run_endpoints = defaultdict(Counter)
+# Token generati, latenza, fase di eval e task per (modello, variante base, modalita', formato)
+format_stats = defaultdict(lambda: defaultdict(list))
+
+
+def log_generation(cell: GridCell, output: dict, latency: float):
+    gen = cell.gen
+    # Le celle esistono solo per le generazioni da (ri)scrivere: build_cells e adaptive_round
+    # escludono quelle gia' salvate con l'impronta attuale, a meno di refresh_cache
+    tracker.after(save_output, cell, output["text"])
+    # Per le risposte in cache riportiamo la latenza della generazione originale
+    tracker.log_metric(cell.run_id, f"latency_gen_{gen}", output["latency"])
+    tracker.log_metric(cell.run_id, f"cache_hit_gen_{gen}", int(output["cached"]))
+    run_stats[cell.run_id]["latency"].append(output["latency"])
+    if "endpoint" in output and not output["cached"]:
+        run_endpoints[cell.run_id][output["endpoint"]] += 1
+    if output.get("prompt_tokens"):
+        tracker.log_metric(cell.run_id, f"prompt_tokens_gen_{gen}", output["prompt_tokens"])
+    if output.get("completion_tokens"):
+        tracker.log_metric(cell.run_id, f"completion_tokens_gen_{gen}", output["completion_tokens"])
+    tasks = len(parse_output(output["text"])[1])
+    tracker.log_metric(cell.run_id, f"tasks_gen_{gen}", tasks)
+    # Generazione interrotta da max_output_tokens
+    if output.get("finish_reason") == "length":
+        tracker.log_metric(cell.run_id, f"truncated_gen_{gen}", 1)
+        run_tail[cell.run_id]["truncated_generations"] += 1
+    fmt = "json" if cell.prompt_name in structured_variants else "text"
+    stats = format_stats[(cell.model, cell.prompt_name.removesuffix("_json"), cell.input_mode, fmt)]
+    stats["completion_tokens"].append(output.get("completion_tokens", 0))
+    stats["latency"].append(output["latency"])
+    stats["tasks"].append(tasks)
+    if "render_time" in output:
+        phases = phase_times(output["render_time"], output["http_time"], output["server"], output.get("ttft"))
+        for phase in PHASES:
+            tracker.log_metric(cell.run_id, f"{phase}_time_gen_{gen}", phases[phase])
+        run_spans[cell.run_id].extend(generation_spans(gen, phases, output["server"]))
+        if not output["cached"]:
+            for phase in PHASES:
+                run_stats[cell.run_id][f"{phase}_time"].append(phases[phase])
+            phase_summaries[cell.model].add(phases)
+            stats["eval_time"].append(phases["eval"])
+    if "ttft" in output:
+        decode_time = output["latency"] - output["ttft"]
+        decode_tps = output["completion_tokens"] / decode_time if decode_time > 0 else 0.0
+        tracker.log_metric(cell.run_id, f"ttft_gen_{gen}", output["ttft"])
+        tracker.log_metric(cell.run_id, f"decode_tps_gen_{gen}", decode_tps)
+        run_stats[cell.run_id]["ttft"].append(output["ttft"])
+        run_stats[cell.run_id]["decode_tps"].append(decode_tps)
+    server = output.get("server") or {}
+    if "prompt_eval_duration" in server:
+        prompt_eval = server["prompt_eval_duration"] / 1e9
+    else:
+        prompt_eval = output.get("ttft")
+    if prefix_planning and not output["cached"] and prompt_eval is not None:
+        # Stessi gruppi di plan_cells: immagini e HTML hanno prefissi e riscaldamenti distinti
+        group = (cell.model, cell.prompt_name, cell.input_mode)
+        if (cell.run_id, gen) in warmup_cells:
+            cold_prompt_eval[group] = prompt_eval
+        elif group in cold_prompt_eval:
+            saved = max(0.0, cold_prompt_eval[group] - prompt_eval)
+            tracker.log_metric(cell.run_id, f"prompt_eval_saved_est_gen_{gen}", saved)
+            run_stats[cell.run_id]["prompt_eval_saved_est"].append(saved)
+
+
+# Tempo di calcolo della generazione sul server (prompt-eval + eval di Ollama): esclude
+# l'attesa dello slot e del caricamento, che total_duration invece comprende. Le risposte in
+# cache non costano nulla neanche in serie; con l'endpoint OpenAI-compatibile non c'e'.
+def service_time(output: dict) -> float | None:
+    if output["cached"]:
+        return 0.0
+    server = output.get("server") or {}
+    if "eval_duration" not in server:
+        return None
+    return (server.get("prompt_eval_duration", 0) + server["eval_duration"]) / 1e9
+
+
+def close_run(run_id: str, failed: bool):
+    stats = run_stats.pop(run_id, {})
+    if stats.get("prompt_eval_saved_est"):
+        tracker.log_metric(run_id, "prompt_eval_saved_est_total", sum(stats["prompt_eval_saved_est"]))
+    if stats.get("render_time"):
+        for phase in PHASES:
+            tracker.log_metric(run_id, f"{phase}_time_total", sum(stats[f"{phase}_time"]))
+        tracker.log_metric(run_id, "timed_generations", len(stats["render_time"]))
+    for url, count in run_endpoints.pop(run_id, {}).items():
+        tracker.log_metric(run_id, f"generations_{endpoint_slug(url)}", count)
+    spans = run_spans.pop(run_id, [])
+    if spans:
+        tracker.after(client.log_dict, run_id, spans, "phase_spans.json")
+    for name, values in stats.items():
+        if values:
+            tracker.log_metric(run_id, f"{name}_p50", percentile(values, 50))
+            tracker.log_metric(run_id, f"{name}_p95", percentile(values, 95))
+    tail = run_tail.pop(run_id, Counter())
+    for event in ("timeouts", "retries", "hedged_requests", "hedge_wins", "truncated_generations"):
+        tracker.log_metric(run_id, event, tail[event])
+    if cache is not None:
+        tracker.log_metric(run_id, "cache_hits", cache.hits[run_id])
+        tracker.log_metric(run_id, "cache_misses", cache.misses[run_id])
+    status = "FAILED" if failed else "FINISHED"
+    tracker.terminate(run_id, status=status)
+    tracker.after(completion.record_closed, run_id, status)
+    print(f"Run completed: {run_names[run_id]}" + (" (with failures)" if failed else ""))
+
+
+def run_model(model: str, load: ModelLoad):
+    phase_summaries[model].add_model_load(load.wall_time)
+    cells = build_cells(model, load)
+    warmup = 0
+    if prefix_planning:
+        warm, rest = plan_cells(cells, key=lambda cell: (cell.model, cell.prompt_name, cell.input_mode))
+        warmup_cells.update((cell.run_id, cell.gen) for cell in warm)
+        cells, warmup = warm + rest, len(warm)
+    report = asyncio.run(run_grid(
+        cells, generate, max_concurrency, log_generation, close_run, warmup=warmup,
+        service_time=service_time,
+    ))
+    print(f"[{model}] " + report.summary())
+    print(phase_summaries[model].report(f"[{model}] Time breakdown"))
+    log_endpoint_stats(model)
+    log_format_comparison(model)
+    return report
+
+
+def adaptive_samplers() -> dict:
+    max_generations = max(num_generations, adaptive_min_generations)
+    return {
+        (prompt_name, mode): AdaptiveSampler(
+            adaptive_coarse, adaptive_min_generations, max_generations,
+            adaptive_stable_threshold, adaptive_refine_delta,
+        )
+        for mode in input_modes
+        for prompt_name in prompt_variants
+    }
+
+
+# Output di una generazione gia' salvata con l'impronta attuale (sweep adattiva ripresa):
+# dalla cache delle risposte o, se non c'e', dall'artifact della run. None = da eseguire.
+restored_outputs = {}
+
+
+def restored_output(model: str, prompt_name: str, mode: str, t: float, gen: int) -> str | None:
+    run_name = make_run_name(model, prompt_name, t, mode)
+    key = cell_key(model, prompt_name, mode, t, gen)
+    if refresh_cache or not completion.is_done(run_name, gen, key):
+        return None
+    if key not in restored_outputs:
+        entry = cache.get(key, scope="resume") if cache is not None else None
+        if entry is not None:
+            restored_outputs[key] = entry["text"]
+        else:
+            try:
+                local = client.download_artifacts(completion.run_ids[run_name], f"output_{prompt_name}_gen_{gen}.txt")
+                with open(local, encoding="utf-8") as f:
+                    restored_outputs[key] = f.read()
+            except (OSError, MlflowException) as exc:
+                print(f"Saved output not readable, regenerating: {run_name} gen {gen}: {exc!r}")
+                return None
+    return restored_outputs[key]
+
+
+# Prossimo round dei sampler: le generazioni gia' salvate vengono registrate subito, le
+# altre restituite come (variante, modalita', temperatura, generazione) da eseguire
+def adaptive_round(model: str, samplers: dict) -> tuple[list[tuple], list[str]]:
+    pending = []
+    restored = []
+    for (prompt_name, mode), sampler in samplers.items():
+        for t, gen in sampler.next_round():
+            text = restored_output(model, prompt_name, mode, t, gen)
+            if text is None:
+                pending.append((prompt_name, mode, t, gen))
+            else:
+                sampler.record(t, gen, text)
+                restored.append(make_run_name(model, prompt_name, t, mode))
+    return pending, restored
+
+
+# Sweep adattiva: round successivi di celle scelte dagli AdaptiveSampler (uno per
+# variante di prompt), eseguite tutte insieme con la stessa concorrenza della griglia.
+# Ripresa: le generazioni gia' salvate vengono lette invece di essere rieseguite, e le
+# run gia' chiuse le cui generazioni sono tutte salvate non vengono riaperte.
+def run_model_adaptive(model: str, load: ModelLoad):
+    phase_summaries[model].add_model_load(load.wall_time)
+    samplers = adaptive_samplers()
+    runs = {}
+    restored_runs = set()
+    decisions = defaultdict(list)
+    failed = set()
+    round_index = 0
+    while True:
+        pending, restored = adaptive_round(model, samplers)
+        restored_runs.update(restored)
+        if not pending and not restored:
+            break
+        cells = []
+        for prompt_name, mode, t, gen in pending:
+            if (prompt_name, mode, t) not in runs:
+                runs[(prompt_name, mode, t)] = open_run(model, prompt_name, t, load, mode)
+            run_id, run_name = runs[(prompt_name, mode, t)]
+            cells.append(GridCell(run_id, run_name, model, prompt_name, t, gen, prompt_inputs[(prompt_name, mode)], mode))
+
+        if cells:
+            outputs = []
+
+            def collect(cell: GridCell, output: dict, latency: float):
+                outputs.append((cell, output))
+                log_generation(cell, output, latency)
+
+            report = asyncio.run(run_grid(cells, generate, max_concurrency, collect, service_time=service_time))
+            print(f"[{model}] adaptive round {round_index}: " + report.summary())
+            for cell, output in outputs:
+                samplers[(cell.prompt_name, cell.input_mode)].record(cell.temperature, cell.gen, output["text"])
+            # Una temperatura con generazioni fallite non viene ritentata all'infinito
+            for cell in cells:
+                if (cell.run_id, cell.gen) in report.failures:
+                    failed.add(cell.run_id)
+                    samplers[(cell.prompt_name, cell.input_mode)].stopped[round(cell.temperature, 2)] = "failed"
+
+        for (prompt_name, mode), sampler in samplers.items():
+            for decision in sampler.decide():
+                decisions[(prompt_name, mode)].append({**decision, "round": round_index})
+                key = (prompt_name, mode, decision["temperature"])
+                if key in runs and decision["variation"] is not None:
+                    run_id = runs[key][0]
+                    tracker.log_metric(run_id, "task_variation", decision["variation"], step=round_index)
+                    tracker.set_tag(run_id, "adaptive_action", decision["action"])
+        round_index += 1
+
+    grid_calls = len(temperatures) * num_generations
+    for (prompt_name, mode, t), (run_id, run_name) in runs.items():
+        sampler = samplers[(prompt_name, mode)]
+        tracker.log_metric(run_id, "adaptive_calls", sampler.calls)
+        tracker.log_metric(run_id, "grid_equivalent_calls", grid_calls)
+        tracker.after(client.log_dict, run_id, decisions[(prompt_name, mode)],
+                      f"adaptive_decisions_{prompt_name}_{mode}.json")
+        close_run(run_id, run_id in failed)
+    # Run con tutte le generazioni gia' salvate: chiuse solo se un crash ha impedito la chiusura
+    opened = {name for _, name in runs.values()}
+    for run_name in sorted(restored_runs - opened):
+        run_id = completion.run_ids[run_name]
+        if run_id not in completion.closed:
+            tracker.terminate(run_id)
+            tracker.after(completion.record_closed, run_id, "FINISHED")
+        print(f"Run already completed, skipped: {run_name}")
+    print(phase_summaries[model].report(f"[{model}] Time breakdown"))
+    log_endpoint_stats(model)
+    log_format_comparison(model)
+    for (prompt_name, mode), sampler in samplers.items():
+        print(f"[{model}] {prompt_name} ({mode}): {sampler.calls} calls instead of {grid_calls}, "
+              f"temperatures {sampler.temperatures}, stops {sampler.stopped}")
+
+
+# Throughput di ogni endpoint durante il gruppo di un modello, in una run di servizio
+def log_endpoint_stats(model: str):
+    print(endpoints.summary())
+    run_id = tracker.create_run(
+        f"endpoint_pool_{model}", tags={"run_type": "endpoint_pool", "model": model},
+    )
+    tracker.log_param(run_id, "ollama_endpoints", ",".join(endpoints.urls))
+    tracker.log_metric(run_id, "failovers", endpoints.failovers)
+    for endpoint in endpoints.endpoints:
+        for name, value in endpoint.stats().items():
+            tracker.log_metric(run_id, f"{endpoint.slug}_{name}", value)
+    tracker.terminate(run_id)
+    endpoints.reset_stats()
+
+
+# Confronto testo/json per variante: medie di token generati, latenza, eval e task, e
+# rapporto json/testo dei token, in una run di servizio (solo con entrambi i formati)
+def log_format_comparison(model: str):
+    groups = {key: format_stats.pop(key) for key in list(format_stats) if key[0] == model}
+    if len(output_formats) < 2 or not groups:
+        return
+    run_id = tracker.create_run(
+        f"output_format_{model}", tags={"run_type": "output_format", "model": model},
+    )
+    print(f"[{model}] Output format comparison (mean per generation)")
+    for (_, prompt_name, mode, fmt), stats in sorted(groups.items()):
+        name = prompt_name if mode == "images" else f"{prompt_name}_{mode}"
+        means = {k: sum(v) / len(v) for k, v in stats.items() if v}
+        for k, value in means.items():
+            tracker.log_metric(run_id, f"{name}_{fmt}_{k}_mean", value)
+        print(f"  {name:<18} {fmt:<5} tokens={means.get('completion_tokens', 0):8.1f} "
+              f"latency={means.get('latency', 0):7.2f}s eval={means.get('eval_time', 0):7.2f}s "
+              f"tasks={means.get('tasks', 0):5.1f}")
+        text_stats = groups.get((model, prompt_name, mode, "text"))
+        if fmt == "json" and text_stats and sum(text_stats["completion_tokens"]):
+            text_tokens = sum(text_stats["completion_tokens"]) / len(text_stats["completion_tokens"])
+            tracker.log_metric(run_id, f"{name}_json_token_ratio", means["completion_tokens"] / text_tokens)
+            tracker.log_metric(run_id, f"{name}_json_latency_ratio",
+                               means["latency"] / (sum(text_stats["latency"]) / len(text_stats["latency"])))
+    tracker.terminate(run_id)
+
+
+# Nella sweep adattiva le decisioni dei sampler vengono ripercorse sulle generazioni gia'
+# salvate: il modello ha lavoro solo se serve almeno una generazione mancante
+def model_has_work(model: str) -> bool:
+    if sampling == "adaptive":
+        samplers = adaptive_samplers()
+        while True:
+            pending, restored = adaptive_round(model, samplers)
+            if pending:
+                return True
+            if not restored:
+                return False
+            for sampler in samplers.values():
+                sampler.decide()
+    return any(missing_generations(model, prompt_name, t, mode) for mode, prompt_name, t in grid_keys())
+
+
+run_models = models if run_all_models else [models[model_choice]]
+healthy_urls = endpoints.check_all()
+if not healthy_urls:
+    raise ConnectionError(f"No Ollama endpoint is reachable: {endpoints.urls}")
+try:
+    reports = run_model_groups(
+        run_models, run_model_adaptive if sampling == "adaptive" else run_model, keep_alive=keep_alive, unload_after=unload_between_models,
+        needs_run=model_has_work, base_url=healthy_urls,
+    )
+finally:
+    # Attende che il thread di logging abbia scritto tutto su MLflow
+    tracker.close()
+    if tracking_backend == "local":
+        client.close()
+        print(f"Run log: {client.log_path} (import with: python ../Shared/local_tracking.py import {client.root})")
+if cache is not None:
+    print(f"Cache: {sum(cache.hits.values())} hits, {sum(cache.misses.values())} misses")
+sweep_phases = PhaseSummary()
+for summary in phase_summaries.values():
+    sweep_phases.merge(summary)
+print(sweep_phases.report("Sweep time breakdown"))